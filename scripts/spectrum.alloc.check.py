@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+####################################################################################
+#
+#  spectrum allocations check - memory allocated per frame by spectrum_calc
+#  in the steady state (after the scratch buffers are created), traced by tracemalloc
+#
+#  run from the repository root: python3 scripts/spectrum.alloc.check.py
+#
+#  the numpy float64 path must stay within ALLOC_LIMIT per frame (numpy ufunc
+#  iterator buffers only), known exceptions are reported but not checked:
+#   - numpy float32 rfft allocates its working copy internally
+#   - scipy and pyfftw backends allocate the result on every call (no out=)
+#
+####################################################################################
+
+from os.path import dirname,join as path_join
+from sys import path as sys_path,exit as sys_exit
+import tracemalloc
+
+sys_path.insert(0,path_join(dirname(dirname(__file__)),'src'))
+
+from numpy import float32,float64,log10,hanning
+from numpy.random import default_rng
+import spectrum
+
+ALLOC_LIMIT=128*1024
+FRAMES=20
+CHANNELS=2
+
+def frame_alloc(fft_size,dtype,fba,smooth,tda):
+    plan=spectrum.spectrum_plan_get(fft_size,'blackman',48000,1024,dtype,CHANNELS,log10(20),log10(24000))
+    smooth_window=hanning(5)
+    smooth_window/=smooth_window.sum()
+    opt={'each':True,'fba':fba,'smooth':smooth,'smooth_window':smooth_window,'tda':tda,'tda_factor':0.3,
+        'hold_max':tda,'hold_min':tda,'hold_decay':3.0,'peaks':False,'peaks_avg_factor':10,'peaks_dist_factor':10,'peaks_limit':3,
+        'zoom_f':None,'zoom_only':False}
+
+    tail=default_rng(0).standard_normal((CHANNELS,plan['tail_size'])).astype(dtype)
+    state={}
+    for _ in range(3):
+        spectrum.spectrum_calc(tail,plan,opt,state)
+
+    tracemalloc.start()
+    worst=0
+    for _ in range(FRAMES):
+        tracemalloc.reset_peak()
+        current=tracemalloc.get_traced_memory()[0]
+        spectrum.spectrum_calc(tail,plan,opt,state)
+        worst=max(worst,tracemalloc.get_traced_memory()[1]-current)
+    tracemalloc.stop()
+
+    return worst
+
+failed=False
+backends=spectrum.fft_backends()
+for backend_name,rfft in backends.items():
+    spectrum.fft_rfft=rfft
+    for fft_size in (4096,65536):
+        for dtype in (float64,float32):
+            for fba,smooth,tda in ((False,False,False),(True,False,False),(True,True,True)):
+                worst=frame_alloc(fft_size,dtype,fba,smooth,tda)
+                checked=backend_name=='numpy' and dtype==float64
+                status=('OK' if worst<=ALLOC_LIMIT else 'FAIL') if checked else 'info'
+                failed|=status=='FAIL'
+                print(f'{backend_name:7} {fft_size:6} {dtype.__name__:8} fba:{fba:d} smooth:{smooth:d} tda+holds:{tda:d} {worst/1024:9.1f}kB {status}')
+
+sys_exit(1 if failed else 0)
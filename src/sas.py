@@ -38,6 +38,16 @@
 #                                                                                    #
 ######################################################################################
 
+import sys
+
+if len(sys.argv)>2 and sys.argv[1]=='--spectrum-worker':
+    #spectrum worker process (spectrum engine:process) - no GUI
+    #authkey comes through stdin - not visible in the process list (no sys.stdin in windowed builds - fd 0 read directly)
+    from os import read as os_read
+    from spectrum import spectrum_worker
+    spectrum_worker(sys.argv[2],(sys.stdin.readline() if sys.stdin else os_read(0,256).decode()).strip())
+    sys.exit(0)
+
 import dearpygui.dearpygui as dpg
 from dearpygui.dearpygui import create_context,get_plot_mouse_pos,set_value,get_value,bind_item_theme,item_handler_registry,plot,add_line_series,theme,configure_item,render_dearpygui_frame,is_dearpygui_running,destroy_context,theme_component,add_item_hover_handler,bind_item_handler_registry,add_mouse_click_handler,add_mouse_release_handler,add_key_press_handler,add_mouse_wheel_handler,handler_registry,add_combo,child_window,table_row,add_checkbox,add_text,add_table_column,window,table,is_item_hovered,tooltip,add_image_button,add_static_texture,texture_registry
 from dearpygui.dearpygui import create_viewport,get_viewport_client_width,get_viewport_client_height,set_viewport_height,hide_item,show_item,set_item_height,set_item_width,get_viewport_height,show_viewport,set_item_pos,set_primary_window,mvTooltip,get_callback_queue,run_callbacks
@@ -47,37 +57,35 @@ from dearpygui.dearpygui import mvKey_LControl,mvKey_LShift,get_mouse_pos,get_vi
 from time import strftime,time,localtime,perf_counter,sleep
 from gc import collect as gc_collect, freeze as gc_freeze
 
-from numpy import mean as np_mean,square as np_square,float32,ones,hanning,hamming,blackman,bartlett, abs as np_abs,fft as np_fft,log10 as np_log10,__version__ as numpy_version, concatenate as np_concatenate,sum as np_sum, arange, linspace, sin as np_sin,zeros, digitize,bincount,isnan,array as np_array, pad as np_pad, convolve as np_convolve, roll as np_roll, cumsum as np_cumsum,clip,frombuffer,uint8,inf as np_inf,multiply,float64,pi
-from numpy.lib.stride_tricks import sliding_window_view
-np_fft_rfft=np_fft.rfft
+from numpy import mean as np_mean,square as np_square,float32,ones,hanning,log10 as np_log10,__version__ as numpy_version, concatenate as np_concatenate,sum as np_sum, arange, linspace, sin as np_sin,zeros,array as np_array, pad as np_pad,clip,frombuffer,uint8,multiply,float64,pi
+from numpy import ndarray,dtype as np_dtype,cos as np_cos
 
-from threading import Thread
+from threading import Thread,Event
 
 from sounddevice import InputStream,OutputStream,query_devices,query_hostapis,__version__ as sounddevice_version,get_portaudio_version,check_input_settings,check_output_settings,_initialize,_terminate
 
 from collections import deque
 from itertools import islice
 
-from math import log10, ceil, floor
+from math import log10, ceil, floor, exp
 from PIL import Image
 Image_fromarray=Image.fromarray
 
 from pathlib import Path
 from json import dumps,loads
 
-from subprocess import Popen
+from subprocess import Popen,PIPE
 
 import os
 from os import name as os_name, system, sep, environ
 from os.path import join as path_join,dirname,abspath
 
-import sys
 from sys import exit as sys_exit
 
 from images import image
+from spectrum import spectrum_calc,spectrum_plan_get,spectrum_plans,halfband_decimate,halfband_make,DECIMATE_TAPS,DECIMATE_BETA,SLIDING_BLOCK,fft_rfft,ZOOM_BINS,fft_backend_name,fft_backend_time
 Image_open=Image.open
 
-from heapq import nlargest
 import logging
 
 from io import BytesIO
@@ -333,6 +341,10 @@ COLORS[0]['FFT_LINE_AVG'] = (0,0,0,40)
 COLORS[0]['FFT_LINE2'] = (245,245,245,100)
 COLORS[0]['FFT_FILL'] = (170,170,150,50)
 COLORS[0]['FFT_FILL_LINE'] = (180,180,180,150)
+COLORS[0]['FFT_LINE_ZOOM'] = (200,40,40,200)
+COLORS[0]['FFT_HOLD_MAX'] = (160,60,0,110)
+COLORS[0]['FFT_HOLD_MIN'] = (0,90,160,110)
+COLORS[0]['FFT_LINE_CH'] = ((200,60,60,120),(40,140,40,120),(40,80,200,120),(190,120,0,120),(140,40,160,120),(0,140,150,120),(120,90,60,120))
 
 COLORS[0]['BG_CONS'] = (255,255,255,50)
 COLORS[0]['CONS_INFO'] = (0,40,0,255)
@@ -376,6 +388,10 @@ COLORS[1]['FFT_LINE_AVG'] = (255,255,255,40)
 COLORS[1]['FFT_LINE2'] = (10,10,10,100)
 COLORS[1]['FFT_FILL'] = (200,200,200,30)
 COLORS[1]['FFT_FILL_LINE'] = (200,200,200,100)
+COLORS[1]['FFT_LINE_ZOOM'] = (255,110,90,200)
+COLORS[1]['FFT_HOLD_MAX'] = (255,170,80,120)
+COLORS[1]['FFT_HOLD_MIN'] = (110,180,255,120)
+COLORS[1]['FFT_LINE_CH'] = ((255,120,120,130),(120,230,120,130),(130,160,255,130),(255,200,80,130),(220,130,255,130),(80,220,230,130),(210,180,140,130))
 
 COLORS[1]['BG_CONS'] = (60,60,60,255)
 COLORS[1]['CONS_INFO'] = (200,235,200,255)
@@ -458,6 +474,26 @@ for ti in themes_indexes:
             dpg.add_theme_color(dpg.mvPlotCol_Line,COLORS[ti]['FFT_FILL_LINE'],category=dpg.mvThemeCat_Plots)
             dpg.add_theme_style(dpg.mvPlotStyleVar_LineWeight,1.0,category=dpg.mvThemeCat_Plots)
 
+    for ch,color in enumerate(COLORS[ti]['FFT_LINE_CH'],1):
+        with theme() as theme_temp:
+            themes[ti][f'fft_line_ch{ch}']=theme_temp
+            with theme_component(dpg.mvLineSeries):
+                dpg.add_theme_color(dpg.mvPlotCol_Line,color,category=dpg.mvThemeCat_Plots)
+                dpg.add_theme_style(dpg.mvPlotStyleVar_LineWeight,1.0,category=dpg.mvThemeCat_Plots)
+
+    with theme() as theme_temp:
+        themes[ti]['fft_line_zoom']=theme_temp
+        with theme_component(dpg.mvLineSeries):
+            dpg.add_theme_color(dpg.mvPlotCol_Line,COLORS[ti]['FFT_LINE_ZOOM'],category=dpg.mvThemeCat_Plots)
+            dpg.add_theme_style(dpg.mvPlotStyleVar_LineWeight,1.5,category=dpg.mvThemeCat_Plots)
+
+    for hold in ('max','min'):
+        with theme() as theme_temp:
+            themes[ti][f'fft_hold_{hold}']=theme_temp
+            with theme_component(dpg.mvLineSeries):
+                dpg.add_theme_color(dpg.mvPlotCol_Line,COLORS[ti][f'FFT_HOLD_{hold.upper()}'],category=dpg.mvThemeCat_Plots)
+                dpg.add_theme_style(dpg.mvPlotStyleVar_LineWeight,1.0,category=dpg.mvThemeCat_Plots)
+
     with theme() as theme_temp:
         themes[ti]['fft_line2']=theme_temp
         with theme_component(dpg.mvLineSeries):
@@ -611,6 +647,9 @@ def build_gui():
                         add_plot_annotation(tag='cursor_f_txt',label='',default_value=(10, -5), color=(0, 0, 0, 0), offset=(5,0))
                         add_plot_annotation(tag='cursor_db_txt',label='',default_value=(100, -30), color=(0, 0, 0, 0), offset=(0,0))
 
+                        for slot in range(PEAKS_POOL):
+                            add_plot_annotation(tag=f'peak{slot}',label='',default_value=(20, -120), color=(0, 0, 0, 0), offset=(10,-10), show=False)
+
                         with dpg.plot_axis(dpg.mvXAxis, tag='x_axis',no_highlight=True) as xaxis:
                             configure_item(dpg.last_item(),scale=dpg.mvPlotScale_Log10)
                             set_axis_limits("x_axis", fmin,fmax)
@@ -632,6 +671,14 @@ def build_gui():
 
                             add_line_series([20], [-120], tag="fft_avg")
 
+                            for ch in range(1,FFT_CHANNELS_MAX):
+                                add_line_series([20], [-120], tag=f"fft_line_ch{ch}",show=False)
+
+                            add_line_series([20], [-120], tag="fft_line_zoom",show=False)
+
+                            add_line_series([20], [-120], tag="fft_hold_max",show=False)
+                            add_line_series([20], [-120], tag="fft_hold_min",show=False)
+
                             for lab,val in xticks:
                                 if lab:
                                     add_line_series([val,val], [-130,0],tag=f'stick{val}')
@@ -779,6 +826,12 @@ def build_gui():
                                 with table_row():
                                     add_checkbox(tag='fft_tda',label='TDA',callback=fft_tda_callback,default_value=cfg['fft_tda']); FFT_tda_tooltip='Time Domain Averaging\n\nkey: F7 / Shift+F7 (+Ctrl Toggle)'; widget_tooltip(FFT_tda_tooltip)
                                     add_slider_float(tag='fft_tda_factor',callback=fft_tda_factor_callback,max_value=0.95,min_value=0.05,default_value=cfg['fft_tda_factor'],format="%.2f",width=130,track_offset=0.5); widget_tooltip(FFT_tda_tooltip)
+                                FFT_hold_tooltip='Peak-hold (Max) and min-hold (Min) traces\nof the main trace, decaying by [dB/s]'
+                                with table_row():
+                                    add_checkbox(tag='fft_hold_max',label='Max',callback=fft_hold_callback,default_value=cfg['fft_hold_max']); widget_tooltip(FFT_hold_tooltip)
+                                    add_slider_float(tag='fft_hold_decay',callback=fft_hold_decay_callback,max_value=60.0,min_value=0.0,default_value=cfg['fft_hold_decay'],format="%.1f dB/s",width=130,track_offset=0.5); widget_tooltip(FFT_hold_tooltip)
+                                with table_row():
+                                    add_checkbox(tag='fft_hold_min',label='Min',callback=fft_hold_callback,default_value=cfg['fft_hold_min']); widget_tooltip(FFT_hold_tooltip)
 
                                 with table_row():
                                     add_checkbox(tag='peaks',label='Peaks',callback=peaks_callback,default_value=cfg['peaks']); widget_tooltip('Peaks detection')
@@ -795,8 +848,68 @@ def build_gui():
                                     add_text(default_value='Limit')
                                     add_slider_int(tag='peaks_limit',callback=peaks_limit_change,max_value=32,min_value=1,default_value=cfg['peaks_limit'],width=130,track_offset=0.5); widget_tooltip('Absolute limit of peaks shown')
 
+                    with child_window(border=True,autosize_y=False,autosize_x=False,width=220,no_scrollbar=False,height=settings_height-5):
+                        with group(width=-1):
+                            add_text(default_value='ANALYSIS')
+                            dpg.add_separator()
+
+                            with table(header_row=False, resizable=False, policy=mvTable_SizingStretchProp,
+                                    borders_innerH=False, borders_innerV=False, borders_outerH=False, borders_outerV=False,
+                                    row_background=False, context_menu_in_body=False, freeze_rows=0, freeze_columns=0,
+                                    no_host_extendX=False, no_host_extendY=False, pad_outerX=False, no_pad_outerX=True):
+
+                                c2width=130
+                                add_table_column(width_fixed=True, init_width_or_weight=70, width=70)
+                                add_table_column(width_fixed=True, init_width_or_weight=c2width, width=c2width)
+
+                                with table_row():
+                                    add_text(default_value='interval'); analysis_interval_tooltip='Level stage interval [ms]\n\nInput level and tracks recording are updated\nwhen new samples arrive, but not more often\nthan this. Independent of FFT settings.'; widget_tooltip(analysis_interval_tooltip)
+                                    add_combo(tag='analysis_interval',items=('0','5','10','20','50','100'),default_value=cfg['analysis_interval'],callback=analysis_interval_callback,width=c2width); widget_tooltip(analysis_interval_tooltip)
+                                with table_row():
+                                    add_text(default_value='FFT hop'); FFT_hop_tooltip='FFT hop\n\nOverlap of subsequent FFT windows [%]\nor fixed number of FFT updates per second.\nFFT is calculated exactly on hop boundaries.'; widget_tooltip(FFT_hop_tooltip)
+                                    add_combo(tag='fft_hop',items=('0%','25%','50%','75%','87.5%','10/s','20/s','30/s','60/s'),default_value=cfg['fft_hop'],callback=fft_hop_callback,width=c2width); widget_tooltip(FFT_hop_tooltip)
+                                with table_row():
+                                    add_text(default_value='FFT rate'); spectrum_rate_tooltip='Spectrum stage rate limit\n\nhop - FFT on every hop boundary\nN/s - not more often than N times per second,\n      the newest window is used'; widget_tooltip(spectrum_rate_tooltip)
+                                    add_combo(tag='spectrum_rate',items=('hop','60/s','30/s','20/s','10/s','5/s','1/s'),default_value=cfg['spectrum_rate'],callback=spectrum_rate_callback,width=c2width); widget_tooltip(spectrum_rate_tooltip)
+                                with table_row():
+                                    add_text(default_value='Welch'); FFT_welch_tooltip='Welch averaging\n\nNumber of FFT size segments (50% overlap)\nanalysed in one batched FFT, their power\nis averaged. Smooth noise floor with\nsmaller FFT size and shorter latency\nthan one long FFT.'; widget_tooltip(FFT_welch_tooltip)
+                                    add_combo(tag='fft_welch',items=('off','2','4','8','16','32'),default_value=cfg['fft_welch'],callback=fft_welch_callback,width=c2width); widget_tooltip(FFT_welch_tooltip)
+                                with table_row():
+                                    add_text(default_value='multi-res'); FFT_multires_tooltip='Multi-resolution analysis\n\nNumber of levels. Every next level is the\ninput decimated by 2 analysed with the same\nFFT size - twice longer window and finer bins\nfor the lower octave. Levels are stitched into\none spectrum (constant-Q like), at a fraction\nof the cost of one long FFT.\n\nWelch averaging is not used with multi-res.'; widget_tooltip(FFT_multires_tooltip)
+                                    add_combo(tag='fft_multires',items=('off','2','3','4','5','6','7','8'),default_value=cfg['fft_multires'],callback=fft_multires_callback,width=c2width); widget_tooltip(FFT_multires_tooltip)
+                                with table_row():
+                                    add_text(default_value='sliding'); FFT_sliding_tooltip='Sliding DFT\n\nDFT of the newest FFT size samples calculated\nonly on the bins at the FBA buckets centres and\nupdated incrementally as samples come - no full\nFFT per frame. Very large FFT sizes can refresh\nat the display rate (use FFT hop N/s).\n\nOne bin per bucket instead of the FBA average.\nWelch and multi-res are not used with sliding.'; widget_tooltip(FFT_sliding_tooltip)
+                                    add_combo(tag='fft_sliding',items=('off','on'),default_value=cfg['fft_sliding'],callback=fft_sliding_callback,width=c2width); widget_tooltip(FFT_sliding_tooltip)
+                                with table_row():
+                                    add_text(default_value='zoom'); FFT_zoom_tooltip=f'Zoom analysis\n\nWindow size of the narrowband analysis around\nthe generated frequency (locked, swept or LMB).\nThe newest samples are mixed down by the\ngenerated frequency and only {ZOOM_BINS} bins around\nit are calculated - half of the window resolution\napart. Much finer resolution than FFT at the\nfraction of the long FFT cost.'; widget_tooltip(FFT_zoom_tooltip)
+                                    add_combo(tag='fft_zoom',items=('off','16384','65536','262144'),default_value=cfg['fft_zoom'],callback=fft_zoom_callback,width=c2width); widget_tooltip(FFT_zoom_tooltip)
+                                with table_row():
+                                    add_text(default_value='zoom mode'); FFT_zoom_mode_tooltip='Zoom analysis mode\n\nalongside - zoom trace over the FFT spectrum\nonly      - zoom trace only, FFT is skipped\n            while the frequency is generated'; widget_tooltip(FFT_zoom_mode_tooltip)
+                                    add_combo(tag='fft_zoom_mode',items=('alongside','only'),default_value=cfg['fft_zoom_mode'],callback=fft_zoom_mode_callback,width=c2width); widget_tooltip(FFT_zoom_mode_tooltip)
+                                with table_row():
+                                    add_text(default_value='precision'); FFT_dtype_tooltip='FFT precision\n\nfloat32 (complex64) halves memory bandwidth\nfor large FFT sizes. Differences to float64\nare below 0.002dB above -120dBFS.'; widget_tooltip(FFT_dtype_tooltip)
+                                    add_combo(tag='fft_dtype',items=('float64','float32'),default_value=cfg['fft_dtype'],callback=fft_dtype_callback,width=c2width); widget_tooltip(FFT_dtype_tooltip)
+                                with table_row():
+                                    add_text(default_value='channels'); in_channels_mode_tooltip=f'Input channels analysis\n\navg  - power average of all channels\neach - separate trace for every channel\n       (up to {FFT_CHANNELS_MAX})\n\nPeaks are detected on the first trace.'; widget_tooltip(in_channels_mode_tooltip)
+                                    add_combo(tag='in_channels_mode',items=('avg','each'),default_value=cfg['in_channels_mode'],callback=in_channels_mode_callback,width=c2width); widget_tooltip(in_channels_mode_tooltip)
+                                with table_row():
+                                    add_text(default_value='overload'); in_queue_policy_tooltip='Input overload policy\n\nWhat happens to samples waiting\nfor analysis longer than "max lag":\n\ndrop oldest   - the oldest are skipped\nnewest window - skip to the newest FFT window\n\nDropped samples are shown in debug info.'; widget_tooltip(in_queue_policy_tooltip)
+                                    add_combo(tag='in_queue_policy',items=('drop oldest','newest window'),default_value=cfg['in_queue_policy'],callback=in_queue_policy_callback,width=c2width); widget_tooltip(in_queue_policy_tooltip)
+                                with table_row():
+                                    add_text(default_value='max lag'); in_queue_limit_tooltip='Maximum analysis lag [s]'; widget_tooltip(in_queue_limit_tooltip)
+                                    add_combo(tag='in_queue_limit',items=('0.1','0.25','0.5','1.0'),default_value=cfg['in_queue_limit'],callback=in_queue_limit_callback,width=c2width); widget_tooltip(in_queue_limit_tooltip)
+                                with table_row():
+                                    add_text(default_value='decimation'); in_decimate_tooltip='Input decimation\n\noff  - analysis at the input samplerate\nauto - input above 88.2kHz decimated by 2, 4 or 8\n       to 44.1/48kHz before the analysis\n       (streaming anti-alias halfband filters,\n       passband to 20kHz)\n\nHigh samplerate interfaces cost the same as\n48kHz ones and need no larger FFT size for\nthe same low frequency resolution.'; widget_tooltip(in_decimate_tooltip)
+                                    add_combo(tag='in_decimate',items=('off','auto'),default_value=cfg['in_decimate'],callback=in_decimate_callback,width=c2width); widget_tooltip(in_decimate_tooltip)
+                                with table_row():
+                                    add_text(default_value='level time'); level_time_tooltip='Level integration time [s]\n\nRMS level of the input (current dB)\nused for tracks recording.'; widget_tooltip(level_time_tooltip)
+                                    add_combo(tag='level_time',items=('0.01','0.02','0.05','0.1','0.2','0.5','1.0'),default_value=cfg['level_time'],callback=level_time_callback,width=c2width); widget_tooltip(level_time_tooltip)
+                                with table_row():
+                                    add_text(default_value='engine'); spectrum_engine_tooltip='Spectrum engine\n\nthread  - FFT and post-processing in a separate\n          thread of the application\nprocess - separate worker process, samples and\n          spectra passed through shared memory\n\nWith "process" the GUI does not compete\nfor the GIL with large FFT calculations.\nFFT windows that come while the worker\nis busy are skipped (debug info).'; widget_tooltip(spectrum_engine_tooltip)
+                                    add_combo(tag='spectrum_engine',items=('thread','process'),default_value=cfg['spectrum_engine'],callback=spectrum_engine_callback,width=c2width); widget_tooltip(spectrum_engine_tooltip)
+
                     with group():
-                        with child_window(border=True,autosize_y=False,autosize_x=False,width=210,no_scrollbar=True,height=71):
+                        with child_window(border=True,autosize_y=False,autosize_x=False,width=210,no_scrollbar=True,height=94):
                             with group(width=-1):
                                 add_text(default_value='TRACKS')
                                 dpg.add_separator()
@@ -816,6 +929,9 @@ def build_gui():
                                     with table_row():
                                         add_text(default_value='TDA'); FFT_tooltip6='Time domain averaging'; widget_tooltip(FFT_tooltip6)
                                         add_slider_float(tag='tracks_tda_factor',callback=tracks_tda_factor_callback,max_value=0.95,min_value=0.05,default_value=cfg['tracks_tda_factor'],format="%.2f",width=130,track_offset=0.5); widget_tooltip(FFT_tooltip6)
+                                    with table_row():
+                                        add_text(default_value='detector'); tracks_detector_tooltip='Recorded level detector\n\nrms     - broadband RMS level of the input\nlock-in - level of the generated frequency only,\n          input multiplied by the reference\n          cosine/sine and low-pass filtered\n          (time constant - "level time").\n          Noise, hum and harmonics are rejected,\n          faster sweeps give the same quality.'; widget_tooltip(tracks_detector_tooltip)
+                                        add_combo(tag='tracks_detector',items=('rms','lock-in'),default_value=cfg['tracks_detector'],callback=tracks_detector_callback,width=c2width); widget_tooltip(tracks_detector_tooltip)
 
                         with child_window(border=True,autosize_y=False,autosize_x=False,width=210,no_scrollbar=True,height=106):
                             with group():
@@ -947,13 +1063,33 @@ cfg.setdefault('fft_window','blackman')
 cfg.setdefault('fft_fba',True)
 cfg.setdefault('fft_fba_size',1024)
 
+cfg.setdefault('fft_hop','75%')
+cfg.setdefault('spectrum_rate','hop')
+cfg.setdefault('fft_dtype','float64')
+cfg.setdefault('fft_welch','off')
+cfg.setdefault('fft_multires','off')
+cfg.setdefault('fft_sliding','off')
+cfg.setdefault('fft_zoom','off')
+cfg.setdefault('fft_zoom_mode','alongside')
+cfg.setdefault('in_channels_mode','avg')
+cfg.setdefault('in_queue_policy','drop oldest')
+cfg.setdefault('in_queue_limit','0.25')
+cfg.setdefault('in_decimate','off')
+cfg.setdefault('spectrum_engine','thread')
+cfg.setdefault('level_time','0.1')
+
 cfg.setdefault('fft_tda',False)
 cfg.setdefault('fft_tda_factor',0.1)
 
+cfg.setdefault('fft_hold_max',False)
+cfg.setdefault('fft_hold_min',False)
+cfg.setdefault('fft_hold_decay',3.0)
+
 cfg.setdefault('fft_smooth',True)
 cfg.setdefault('fft_smooth_factor',2)
 
 cfg.setdefault('tracks_tda_factor',0.3)
+cfg.setdefault('tracks_detector','rms')
 
 cfg.setdefault('peaks',False)
 cfg.setdefault('peaks_avg_factor',10)
@@ -987,6 +1123,8 @@ cfg.setdefault("in_wasapi_exclusive",False)
 #cfg.setdefault("dithering_off",True)
 cfg.setdefault("amplitude",30)
 
+cfg.setdefault('analysis_interval','10')
+
 track_line_data_y={}
 
 logging.basicConfig(
@@ -1089,7 +1227,7 @@ plot_min_height=306
 viewport_height_min=(plot_min_height+status_height+title_hight,
                      plot_min_height+status_height+title_hight+settings_height)
 
-viewport_width_min=1110
+viewport_width_min=1335
 
 cfg.setdefault('viewport_height',viewport_height_min[0])
 cfg.setdefault('viewport_width',viewport_width_min)
@@ -1293,10 +1431,16 @@ AMPLITUDE_LOG=aplitude_log_calc(30)
 
 @catch
 def change_f(fpar):
-    global current_logf,two_pi_by_out_samplerate,TRACK_BUCKETS,phase_step_x_phase_i,phase_i,current_bucket
+    global current_logf,current_f,two_pi_by_out_samplerate,TRACK_BUCKETS,phase_step_x_phase_i,phase_i,current_bucket
 
     if fmin_audio<fpar<fmax_audio:
-        current_logf=log10(fpar)
+        logf=log10(fpar)
+
+        #frequency jump (not a sweep step) - lock-in starts over, no I/Q of the previous frequency
+        if abs(logf-current_logf)>log_bucket_tracks_width:
+            lockin_reset()
+
+        current_logf=logf
         current_f=fpar
 
         temp_bucket=logf_to_bucket_tracks(current_logf)
@@ -1367,6 +1511,7 @@ def sweep_callback(sender=None, app_data=None):
         configure_item('sweeping',texture_tag=ico["play_on"])
         change_f(fmin_audio)
         play_start()
+        lockin_reset()
     else:
         play_stop()
 
@@ -1377,6 +1522,7 @@ def play_start():
     global playing_state,track_line_data_y_recorded,redraw_recorded_track_line
     bind_item_theme("cursor_f",red_cursor_theme)
     playing_state=1
+    lockin_reset()
 
     if track_line_data_y_recorded:
         recorded=int(cfg['recorded'])
@@ -1396,14 +1542,59 @@ def play_stop():
 
 current_sample_db=-120
 
-samples_chunks_fifo=deque()
-samples_chunks_fifo_put=samples_chunks_fifo.append
-samples_chunks_fifo_get=samples_chunks_fifo.popleft
-
 ###########################################################
+# single producer (audio_input_callback) / single consumer (processing) ring
+# preallocated, written in place by the callback, positions are free running counters
+# each counter has exactly one writer, so no locks are needed
+
+in_fifo_size=1<<20
+in_fifo_mask=in_fifo_size-1
+in_fifo=zeros((in_fifo_size,1),dtype=float32)
+
+in_fifo_w=0             # samples written (producer)
+in_fifo_r=0             # samples read (consumer)
+in_fifo_blocks=0        # callbacks (producer)
+in_fifo_status=0        # callbacks with status flags set (producer)
+in_fifo_overruns=0      # blocks dropped on full ring (producer)
+in_fifo_last_status=None
+
+def in_fifo_alloc(channels):
+    global in_fifo,in_fifo_size,in_fifo_mask
+
+    #input stream is closed, about 1M samples in total regardless of the number of channels
+    in_fifo_size=1<<max(16,20-(channels-1).bit_length())
+    in_fifo_mask=in_fifo_size-1
+    in_fifo=zeros((in_fifo_size,channels),dtype=float32)
+
+in_event=Event()        # raised by the producer, processing thread blocks on it
+in_event_set=in_event.set
+in_event_wait=in_event.wait
+in_event_clear=in_event.clear
 
 def audio_input_callback(indata, frames, time_info, status):
-    samples_chunks_fifo_put( (indata[:, 0].copy(),status) )
+    global in_fifo_w,in_fifo_blocks,in_fifo_status,in_fifo_overruns,in_fifo_last_status
+
+    if status:
+        in_fifo_last_status=status
+        in_fifo_status+=1
+
+    w=in_fifo_w
+    if w+frames-in_fifo_r>in_fifo_size:
+        in_fifo_overruns+=1
+        return
+
+    i=w & in_fifo_mask
+    end=i+frames
+    if end<=in_fifo_size:
+        in_fifo[i:end]=indata
+    else:
+        first=in_fifo_size-i
+        in_fifo[i:]=indata[:first]
+        in_fifo[:end-in_fifo_size]=indata[first:]
+
+    in_fifo_blocks+=1
+    in_fifo_w=w+frames
+    in_event_set()
 
 def go_to_homepage():
     try:
@@ -1788,7 +1979,7 @@ def out_stream_init():
 
 def in_stream_init():
     configure_item('in_status',texture_tag=ico['in_off'])
-    global stream_in,device_in_current,in_channel_buffer_mod_index
+    global stream_in,device_in_current,in_channel_buffer_mod_index,IN_CHANNELS,precalc_ready
 
     if stream_in is not None:
         stream_in.close()
@@ -1818,6 +2009,21 @@ def in_stream_init():
 
     in_channel_buffer_mod_index=0
 
+    if channels!=IN_CHANNELS:
+        precalc_ready_prev=precalc_ready
+        precalc_ready=False
+
+        IN_CHANNELS=channels
+        in_fifo_alloc(channels)
+        data_ring_resize(data_ring_size)
+        if mr_levels>1:
+            mr_resize(spectrum_pre)
+        if in_decimation>1:
+            in_decimation_resize(in_decimation*analysis_samplerate)
+        spectrum_state.clear()
+
+        precalc_ready=precalc_ready_prev
+
     api=cfg['in_api']
 
     cons_const('')
@@ -2110,6 +2316,18 @@ def fft_callback(sender=None, app_data=None):
     configure_item('fft_tda',enabled=FFT)
     configure_item('fft_tda_factor',enabled=FFT,show=FFT)
 
+    configure_item('fft_hold_max',enabled=FFT)
+    configure_item('fft_hold_min',enabled=FFT)
+    configure_item('fft_hold_decay',enabled=FFT,show=FFT)
+
+    configure_item('fft_hop',enabled=FFT)
+    configure_item('fft_dtype',enabled=FFT)
+    configure_item('fft_welch',enabled=FFT)
+    configure_item('fft_multires',enabled=FFT)
+    configure_item('fft_sliding',enabled=FFT)
+    configure_item('fft_zoom',enabled=FFT)
+    configure_item('fft_zoom_mode',enabled=FFT)
+
     configure_item('peaks',enabled=FFT)
     configure_item('peaks_avg_factor',enabled=FFT,show=FFT)
     configure_item('peaks_dist_factor',enabled=FFT,show=FFT)
@@ -2131,7 +2349,7 @@ def fft_size_callback(sender=None, app_data=None):
     fft_window_callback()
 
 def fft_window_callback(sender=None, app_data=None):
-    global FFT,fft_window,fft_window_sum,cfg,precalc_ready,FFT_SIZE,fft_window_name
+    global FFT,cfg,precalc_ready,FFT_SIZE,fft_window_name
 
     precalc_ready=False
 
@@ -2140,21 +2358,6 @@ def fft_window_callback(sender=None, app_data=None):
     val_str=off_on[FFT]
     cons_opt(f'FFT:{val_str} size:{FFT_SIZE} window:{fft_window_name}' if FFT else f'FFT:{val_str}')
 
-    if fft_window_name=='ones':
-        fft_window=ones(FFT_SIZE)
-    elif fft_window_name=='hanning':
-        fft_window=hanning(FFT_SIZE)
-    elif fft_window_name=='hamming':
-        fft_window=hamming(FFT_SIZE)
-    elif fft_window_name=='blackman':
-        fft_window=blackman(FFT_SIZE)
-    elif fft_window_name=='bartlett':
-        fft_window=bartlett(FFT_SIZE)
-    else:
-        l_error(f'unknown window:{cfg["fft_window"]}')
-
-    fft_window_sum = np_sum(fft_window)
-    l_info(f'{fft_window_sum=}')
     l_info(f'fft_window_callback:{sender},{app_data}')
 
     common_precalc()
@@ -2168,6 +2371,125 @@ def fft_window_callback(sender=None, app_data=None):
         except:
             pass
 
+FFT_WELCH=1 if cfg['fft_welch']=='off' else int(cfg['fft_welch'])
+def fft_welch_callback(sender=None, app_data=None):
+    global FFT_WELCH,precalc_ready,cfg
+
+    precalc_ready=False
+    val=cfg['fft_welch']=get_value('fft_welch')
+    l_info(f'fft_welch_callback:{sender},{app_data}')
+    cons_opt(f'FFT Welch segments:{val}')
+
+    FFT_WELCH=1 if val=='off' else int(val)
+
+    common_precalc()
+
+FFT_MULTIRES=1 if cfg['fft_multires']=='off' else int(cfg['fft_multires'])
+def fft_multires_callback(sender=None, app_data=None):
+    global FFT_MULTIRES,precalc_ready,cfg
+
+    precalc_ready=False
+    val=cfg['fft_multires']=get_value('fft_multires')
+    l_info(f'fft_multires_callback:{sender},{app_data}')
+    cons_opt(f'FFT multi-resolution levels:{val}')
+
+    FFT_MULTIRES=1 if val=='off' else int(val)
+
+    common_precalc()
+
+FFT_SLIDING=cfg['fft_sliding']=='on'
+def fft_sliding_callback(sender=None, app_data=None):
+    global FFT_SLIDING,precalc_ready,cfg
+
+    precalc_ready=False
+    val=cfg['fft_sliding']=get_value('fft_sliding')
+    l_info(f'fft_sliding_callback:{sender},{app_data}')
+    cons_opt(f'FFT sliding DFT:{val}')
+
+    FFT_SLIDING=val=='on'
+
+    common_precalc()
+
+FFT_ZOOM=0 if cfg['fft_zoom']=='off' else int(cfg['fft_zoom'])
+def fft_zoom_callback(sender=None, app_data=None):
+    global FFT_ZOOM,precalc_ready,cfg
+
+    precalc_ready=False
+    val=cfg['fft_zoom']=get_value('fft_zoom')
+    l_info(f'fft_zoom_callback:{sender},{app_data}')
+    cons_opt(f'FFT zoom window:{val}')
+
+    FFT_ZOOM=0 if val=='off' else int(val)
+
+    common_precalc()
+    fft_fill_callback()
+
+FFT_ZOOM_ONLY=cfg['fft_zoom_mode']=='only'
+def fft_zoom_mode_callback(sender=None, app_data=None):
+    global FFT_ZOOM_ONLY,cfg
+
+    val=cfg['fft_zoom_mode']=get_value('fft_zoom_mode')
+    l_info(f'fft_zoom_mode_callback:{sender},{app_data}')
+    cons_opt(f'FFT zoom mode:{val}')
+
+    FFT_ZOOM_ONLY=val=='only'
+
+FFT_DTYPE=float32 if cfg['fft_dtype']=='float32' else float64
+def fft_dtype_callback(sender=None, app_data=None):
+    global FFT_DTYPE,precalc_ready,cfg
+
+    precalc_ready=False
+    val=cfg['fft_dtype']=get_value('fft_dtype')
+    l_info(f'fft_dtype_callback:{sender},{app_data}')
+    cons_opt(f'FFT precision:{val}')
+
+    FFT_DTYPE=float32 if val=='float32' else float64
+
+    fft_window_callback()
+
+FFT_CHANNELS_MAX=8
+IN_CHANNELS=1
+IN_CHANNELS_EACH=cfg['in_channels_mode']=='each'
+fft_lines_ch_shown=1
+fft_zoom_shown=False
+def in_channels_mode_callback(sender=None, app_data=None):
+    global IN_CHANNELS_EACH,cfg
+
+    val=cfg['in_channels_mode']=get_value('in_channels_mode')
+    l_info(f'in_channels_mode_callback:{sender},{app_data}')
+    cons_opt(f'Input channels:{val}')
+
+    IN_CHANNELS_EACH=val=='each'
+
+in_queue_limit_samples=1<<20
+IN_QUEUE_COALESCE=cfg['in_queue_policy']=='newest window'
+def in_queue_policy_callback(sender=None, app_data=None):
+    global IN_QUEUE_COALESCE,cfg
+
+    val=cfg['in_queue_policy']=get_value('in_queue_policy')
+    l_info(f'in_queue_policy_callback:{sender},{app_data}')
+    cons_opt(f'Input overload policy:{val}')
+
+    IN_QUEUE_COALESCE=val=='newest window'
+
+def level_time_callback(sender=None, app_data=None):
+    global precalc_ready,cfg
+
+    precalc_ready=False
+    val=cfg['level_time']=get_value('level_time')
+    l_info(f'level_time_callback:{sender},{app_data}')
+    cons_opt(f'Level integration time:{val}s')
+    common_precalc()
+
+def in_queue_limit_callback(sender=None, app_data=None):
+    global precalc_ready,cfg
+
+    precalc_ready=False
+    val=cfg['in_queue_limit']=get_value('in_queue_limit')
+    l_info(f'in_queue_limit_callback:{sender},{app_data}')
+    cons_opt(f'Input max lag:{val}s')
+    common_precalc()
+
 FFT_FBA=cfg['fft_fba']
 def fft_fba_callback(sender=None, app_data=None):
     global FFT_FBA,precalc_ready,cfg
@@ -2192,15 +2514,51 @@ def fft_fba_size_callback(sender=None, app_data=None):
     cons_opt(f'FFT FBA Size:{FFT_FBA_SIZE}')
     fft_buckets_quant_change()
 
+FFT_HOP=1
+FFT_HOP_IN=1            # FFT_HOP in input samples (before decimation)
+fft_hop_left=1          # input samples
+def fft_hop_calc(in_samplerate_float):
+    global FFT_HOP,FFT_HOP_IN,fft_hop_left
+
+    hop_str=cfg['fft_hop']
+    if hop_str.endswith('/s'):
+        #fixed number of updates per second
+        FFT_HOP=int(in_samplerate_float/float(hop_str[:-2]))
+    else:
+        #overlap of subsequent FFT windows
+        FFT_HOP=int(FFT_SIZE*(1.0-float(hop_str[:-1])*0.01))
+
+    FFT_HOP=max(1,FFT_HOP)
+    FFT_HOP_IN=FFT_HOP*in_decimation
+    fft_hop_left=min(fft_hop_left,FFT_HOP_IN)
+    l_info(f'{FFT_HOP=}')
+
+SPECTRUM_INTERVAL=0.0 if cfg['spectrum_rate']=='hop' else 1.0/float(cfg['spectrum_rate'][:-2])
+def spectrum_rate_callback(sender=None, app_data=None):
+    global SPECTRUM_INTERVAL,cfg
+
+    val=cfg['spectrum_rate']=get_value('spectrum_rate')
+    l_info(f'spectrum_rate_callback:{sender},{app_data}')
+    cons_opt(f'FFT rate:{val}')
+
+    SPECTRUM_INTERVAL=0.0 if val=='hop' else 1.0/float(val[:-2])
+
+def fft_hop_callback(sender=None, app_data=None):
+    global precalc_ready,cfg
+
+    precalc_ready=False
+    val=cfg['fft_hop']=get_value('fft_hop')
+    l_info(f'fft_hop_callback:{sender},{app_data}')
+    cons_opt(f'FFT Hop:{val}')
+    common_precalc()
+
 FFT_TDA_FACTOR=float(cfg['fft_tda_factor'])
-FFT_TDA_FACTOR_1m=1.0-FFT_TDA_FACTOR
 def fft_tda_factor_callback(sender=None, app_data=None):
-    global FFT_TDA_FACTOR,precalc_ready,FFT_TDA_FACTOR_1m,cfg
+    global FFT_TDA_FACTOR,precalc_ready,cfg
 
     precalc_ready=False
     l_info(f'fft_tda_factor_callback:{sender},{app_data}')
     FFT_TDA_FACTOR=cfg['fft_tda_factor']=float(get_value('fft_tda_factor'))
-    FFT_TDA_FACTOR_1m=1.0-FFT_TDA_FACTOR
     cons_opt(f'FFT TDA Factor:{FFT_TDA_FACTOR:.2f}')
     common_precalc()
 
@@ -2221,6 +2579,30 @@ def fft_tda_callback(sender=None, app_data=None):
     else:
         common_precalc()
 
+FFT_HOLD_DECAY=float(cfg['fft_hold_decay'])
+def fft_hold_decay_callback(sender=None, app_data=None):
+    global FFT_HOLD_DECAY,cfg
+
+    l_info(f'fft_hold_decay_callback:{sender},{app_data}')
+    FFT_HOLD_DECAY=cfg['fft_hold_decay']=float(get_value('fft_hold_decay'))
+    cons_opt(f'FFT Hold decay:{FFT_HOLD_DECAY:.1f}dB/s')
+
+FFT_HOLD_MAX=cfg['fft_hold_max']
+FFT_HOLD_MIN=cfg['fft_hold_min']
+fft_holds_shown=[False,False]
+def fft_hold_callback(sender=None, app_data=None):
+    global FFT_HOLD_MAX,FFT_HOLD_MIN,cfg
+
+    FFT_HOLD_MAX=cfg['fft_hold_max']=get_value('fft_hold_max')
+    FFT_HOLD_MIN=cfg['fft_hold_min']=get_value('fft_hold_min')
+    l_info(f'fft_hold_callback:{sender},{app_data},{FFT_HOLD_MAX},{FFT_HOLD_MIN}')
+    cons_opt(f'FFT Hold max:{off_on[FFT_HOLD_MAX]} min:{off_on[FFT_HOLD_MIN]}')
+
+    configure_item('fft_hold_decay',enabled=FFT_HOLD_MAX or FFT_HOLD_MIN,show=FFT_HOLD_MAX or FFT_HOLD_MIN)
+
+    if FFT_HOLD_MAX or FFT_HOLD_MIN:
+        fft_hold_decay_callback()
+
 bucket_fft_freqs=[0]
 bucket_fft_edges=[0]
 
@@ -2296,19 +2678,329 @@ def tracks_tda_factor_callback(sender=None, app_data=None):
     TRACKS_TDA_FACTOR_1m=1.0-TRACKS_TDA_FACTOR
     common_precalc()
 
-data=[0]
+TRACKS_LOCKIN=cfg['tracks_detector']=='lock-in'
+def tracks_detector_callback(sender=None, app_data=None):
+    l_info(f'tracks_detector_callback:{sender},{app_data}')
+    global TRACKS_LOCKIN,cfg
+
+    val=cfg['tracks_detector']=get_value('tracks_detector')
+    cons_opt(f'Tracks level detector:{val}')
+
+    TRACKS_LOCKIN=val=='lock-in'
+    lockin_reset()
+
 FFT_ACTUAL_BUCKETS=0
 
+###########################################################
+# circular sample buffer
+# every sample is written twice (at i and i+size), so the last "size" samples
+# are always available as a contiguous view data_ring[i:i+size] - no np_roll, no unrolling
+
+# one row per input channel, chunks come from in_fifo as (frames,channels)
+
+data_ring_size=1
+data_ring=zeros((1,2))
+data_ring_i=0
+
+#running sum of squares of the newest level_samples samples (all channels)
+#updated as samples enter the ring, recalculated from scratch every level_renorm_period samples against drift
+level_samples=1
+level_sum=0.0
+level_renorm_period=1
+level_renorm_left=0
+
+def level_recalc():
+    global level_sum,level_renorm_left
+
+    level_sum=float(np_sum(np_square(data_ring_tail(level_samples),dtype=float64)))
+    level_renorm_left=level_renorm_period
+
+def level_db():
+    return 10.0*log10(max(level_sum,0.0)/(level_samples*len(data_ring)) + 1e-12)
+
+def ring_write(ring,i,size,chunk):
+    #mirrored write of (channels,n) chunk, returns new write index
+    chunk_len=chunk.shape[1]
+
+    if chunk_len>=size:
+        ring[:,:size]=chunk[:,-size:]
+        ring[:,size:]=chunk[:,-size:]
+        return 0
+
+    end=i+chunk_len
+
+    ring[:,i:end]=chunk
+    if end<=size:
+        ring[:,i+size:end+size]=chunk
+        return end if end<size else 0
+
+    first=size-i
+    ring[:,i+size:]=chunk[:,:first]
+    ring[:,:end-size]=chunk[:,first:]
+    return end-size
+
+def data_ring_put(chunk):
+    global data_ring_i,level_sum,level_renorm_left
+
+    chunk_len=len(chunk)
+    size=data_ring_size
+    chunk=chunk.T
+
+    if chunk_len>=size:
+        data_ring_i=ring_write(data_ring,data_ring_i,size,chunk)
+        level_recalc()
+        return
+
+    level_renorm_left-=chunk_len
+    level_update=chunk_len<level_samples and level_renorm_left>0
+    if level_update:
+        #samples leaving the level window are overwritten below
+        level_sum+=float(np_sum(np_square(chunk,dtype=float64)) - np_sum(np_square(data_ring_tail(level_samples)[:,:chunk_len],dtype=float64)))
+
+    data_ring_i=ring_write(data_ring,data_ring_i,size,chunk)
+
+    if not level_update:
+        level_recalc()
+
+###########################################################
+# lock-in (synchronous) detection of the generated frequency
+# input multiplied by the reference cosine/sine of current_f and low-pass filtered (one pole, time constant level_samples)
+# dual phase (I/Q) - the magnitude does not depend on the output->input latency, so the reference
+# is generated on the input sample clock with its own continuous phase
+
+lockin_two_pi_by_samplerate=0.0
+lockin_phase=0.0
+lockin_i=zeros(1)
+lockin_q=zeros(1)
+
+def lockin_reset():
+    global lockin_i,lockin_q,lockin_phase
+
+    lockin_i=zeros(IN_CHANNELS)
+    lockin_q=zeros(IN_CHANNELS)
+    lockin_phase=0.0
+
+def lockin_put(chunk):
+    global lockin_phase,lockin_i,lockin_q
+
+    chunk_len,channels=chunk.shape
+    if len(lockin_i)!=channels:
+        lockin_reset()
+
+    phase_step=lockin_two_pi_by_samplerate*current_f
+    ref=lockin_phase+phase_step*arange(chunk_len)
+    lockin_phase=(lockin_phase+phase_step*chunk_len)%two_pi
+
+    decay=exp(-chunk_len/level_samples)
+    decay_1m_by_len=(1.0-decay)/chunk_len
+    lockin_i=lockin_i*decay+(np_cos(ref)@chunk)*decay_1m_by_len
+    lockin_q=lockin_q*decay+(np_sin(ref)@chunk)*decay_1m_by_len
+
+def lockin_db():
+    #sine RMS - sqrt(2)*|I+jQ|, power average of channels
+    return 10.0*log10(2.0*float(np_mean(np_square(lockin_i)+np_square(lockin_q))) + 1e-12)
+
+def data_ring_tail(samples):
+    end=data_ring_i+data_ring_size
+    return data_ring[:,end-samples:end]
+
+def data_ring_resize(size):
+    global data_ring,data_ring_size,data_ring_i
+
+    new_ring=zeros((IN_CHANNELS,2*size),dtype=FFT_DTYPE)
+
+    if len(data_ring)==IN_CHANNELS:
+        prev=data_ring_tail(min(size,data_ring_size))
+        prev_len=prev.shape[1]
+        new_ring[:,size-prev_len:size]=prev
+        new_ring[:,2*size-prev_len:]=prev
+
+    data_ring,data_ring_size,data_ring_i=new_ring,size,0
+
+    level_recalc()
+
+###########################################################
+# multi-resolution levels (spectrum plan with multires>1)
+# level k (1..multires-1) holds the input decimated by 2**k, decimated as samples come -
+# halfband lowpass with the state (not consumed samples) kept between chunks
+# level 0 is the data ring
+
+mr_levels=1
+mr_size=1
+mr_ring=[]
+mr_ring_i=[]
+mr_hist=[]
+mr_taps_odd=None
+mr_tap_center=0.5
+
+def mr_resize(plan):
+    global mr_levels,mr_size,mr_ring,mr_ring_i,mr_hist,mr_taps_odd,mr_tap_center
+
+    levels=plan['multires']
+    size=plan['fft_size']
+
+    mr_ring=[zeros((IN_CHANNELS,2*size),dtype=FFT_DTYPE) for level in range(1,levels)]
+    mr_ring_i=[0]*(levels-1)
+    mr_hist=[zeros((IN_CHANNELS,0),dtype=FFT_DTYPE) for level in range(1,levels)]
+    mr_taps_odd,mr_tap_center=plan['mr_taps_odd'],plan['mr_tap_center']
+    mr_levels,mr_size=levels,size
+
+def mr_put(chunk):
+    x=chunk.T
+    for k in range(mr_levels-1):
+        x,mr_hist[k]=halfband_decimate(mr_hist[k],x,mr_taps_odd,mr_tap_center)
+        if not x.shape[1]:
+            break
+        mr_ring_i[k]=ring_write(mr_ring[k],mr_ring_i[k],mr_size,x)
+
+###########################################################
+# sliding DFT (spectrum plan with sliding) - DFT of the newest fft_size samples on the plan sliding_bins only,
+# updated with every input block before it enters the data ring (the leaving samples are still there):
+# S(n+H)=exp(j*theta*H)*(S(n)+sum_m (x_new[m]-x_old[m])*exp(-j*theta*m)), theta=2*pi*bin/fft_size
+# sum over m factorised as m=a*SLIDING_BLOCK+b like the zoom DFT, initialised with one rfft of the data ring
+# and initialised again every SLIDING_RESEED windows - rounding errors of the recursion do not accumulate
+
+SLIDING_RESEED=16
+
+sliding_pre=None
+sliding_s=None
+sliding_samples=0
+
+def sliding_reset(plan):
+    global sliding_pre,sliding_s
+
+    sliding_s=None
+    sliding_pre=plan if plan['sliding'] else None
+
+def sliding_put(chunk):
+    global sliding_s,sliding_samples
+
+    pre=sliding_pre
+    fft_size=pre['fft_size']
+    x=chunk.T
+    chunk_len=x.shape[1]
+
+    if chunk_len>=fft_size:
+        #whole window replaced - initialised again from the data ring on the next block
+        sliding_s=None
+        return
+
+    s=sliding_s
+    if s is None or len(s)!=len(x) or sliding_samples>=SLIDING_RESEED*fft_size:
+        s=fft_rfft(data_ring_tail(fft_size).astype(float64))[:,pre['sliding_bins']]
+        sliding_samples=0
+
+    sliding_e,sliding_e_complex,sliding_f=pre['sliding_e'],pre['sliding_e_complex'],pre['sliding_f']
+    bins=len(pre['sliding_bins'])
+    block_max=SLIDING_BLOCK*SLIDING_BLOCK
+
+    diff=x-data_ring_tail(fft_size)[:,:chunk_len]
+    for start in range(0,chunk_len,block_max):
+        d=diff[:,start:start+block_max]
+        h=d.shape[1]
+        blocks=-(-h//SLIDING_BLOCK)
+        if h<blocks*SLIDING_BLOCK:
+            d=np_pad(d,((0,0),(0,blocks*SLIDING_BLOCK-h)))
+
+        partial=d.reshape(len(d),blocks,SLIDING_BLOCK) @ sliding_e
+        s=s+np_sum((partial[...,:bins]+1j*partial[...,bins:])*sliding_f[:blocks],axis=1)
+        s*=(sliding_e_complex[h%SLIDING_BLOCK]*sliding_f[h//SLIDING_BLOCK]).conj()
+
+    if sliding_pre is pre:
+        sliding_samples+=chunk_len
+        sliding_s=s
+
+def sliding_power(pre):
+    #windowed power of the centre bins (channels,buckets)
+    s=sliding_s
+    take=pre['sliding_take']
+    if s is None or s.shape[1]!=len(pre['sliding_bins']):
+        return zeros((IN_CHANNELS,take.shape[1]),dtype=FFT_DTYPE)
+
+    a0,a1,a2=pre['sliding_coefs']
+    windowed=a0*s[:,take[2]] - (0.5*a1)*(s[:,take[1]]+s[:,take[3]]) + (0.5*a2)*(s[:,take[0]]+s[:,take[4]])
+    return (np_square(windowed.real)+np_square(windowed.imag)).astype(FFT_DTYPE)
+
+###########################################################
+# input decimation front end - high samplerates brought down to 44.1/48kHz before the data ring
+# cascade of streaming halfband decimators (state kept between chunks), the last one with the steeper filter
+# everything after it (data ring, multi-res levels, level, lock-in, spectrum) works at the analysis samplerate
+
+analysis_samplerate=48000.0
+in_decimation=1
+in_dec_key=None
+in_dec_filters=[]
+in_dec_hist=[]
+
+def in_decimation_resize(samplerate):
+    global in_decimation,in_dec_key,in_dec_filters,in_dec_hist
+
+    decimation=1
+    if IN_DECIMATE:
+        while samplerate/(decimation*2)>=44100:
+            decimation*=2
+
+    key=(decimation,IN_CHANNELS,FFT_DTYPE)
+    if key==in_dec_key:
+        return
+
+    stages=decimation.bit_length()-1
+    in_dec_filters=[halfband_make(FFT_DTYPE) for stage in range(stages-1)] + [halfband_make(FFT_DTYPE,DECIMATE_TAPS,DECIMATE_BETA)]*(stages>0)
+    in_dec_hist=[zeros((IN_CHANNELS,0),dtype=FFT_DTYPE) for stage in range(stages)]
+    in_decimation,in_dec_key=decimation,key
+
+    l_info(f'{in_decimation=}')
+
+def in_put(chunk):
+    #(frames,channels) input samples to the data ring and the other consumers
+    if in_decimation>1:
+        x=chunk.T
+        for k,(taps_odd,tap_center) in enumerate(in_dec_filters):
+            x,in_dec_hist[k]=halfband_decimate(in_dec_hist[k],x,taps_odd,tap_center)
+        if not x.shape[1]:
+            return
+        chunk=x.T
+
+    if sliding_pre is not None:
+        sliding_put(chunk)
+    data_ring_put(chunk)
+    if mr_levels>1:
+        mr_put(chunk)
+    if TRACKS_LOCKIN and playing_state==2:
+        lockin_put(chunk)
+
+def spectrum_tail(pre):
+    #newest samples for the spectrum plan, list of (channels,n) parts to be concatenated
+    #zoom samples (if any) are the last part
+    zoom_size=pre['zoom_size']
+
+    if pre['sliding']:
+        tails=[sliding_power(pre)]
+    elif pre['multires']>1:
+        fft_size=pre['fft_size']
+        tails=[data_ring_tail(fft_size)]
+        for k in range(mr_levels-1):
+            end=mr_ring_i[k]+mr_size
+            tails.append(mr_ring[k][:,end-fft_size:end])
+    else:
+        tails=[data_ring_tail(pre['tail_size']-zoom_size)]
+
+    if zoom_size:
+        tails.append(data_ring_tail(zoom_size))
+
+    return tails
+
+
 @catch
 def common_precalc():
     l_info('common_precalc')
 
-    global in_samplerate_by_fft_size,cfg,fft_duration,log_bucket_fft_width,log_bucket_fft_width_by2,bucket_fft_freqs,fft_values_x_all,fft_line_data_y,bucket_fft_edges,fft_bin_indices,fft_bin_counts,next_check,current_sample_db_time_samples,fft_bin_indices_selected,fft_values_x_bins,precalc_ready,FFT_ACTUAL_BUCKETS,fft_values_y_prev,data
+    global in_samplerate_by_fft_size,cfg,fft_duration,bucket_fft_freqs,fft_values_x_all,fft_window,bucket_fft_edges,fft_bin_indices,fft_bin_counts,next_check,current_sample_db_time_samples,fft_bin_indices_selected,fft_values_x_bins,precalc_ready,FFT_ACTUAL_BUCKETS,in_queue_limit_samples,level_samples,level_renorm_period,lockin_two_pi_by_samplerate,analysis_samplerate
 
     in_samplerate=get_value('in_samplerate')
     l_info(f'{in_samplerate=}')
 
-    current_sample_db_time=0.1
+    current_sample_db_time=float(cfg['level_time'])
 
     try:
         in_samplerate_float=float(in_samplerate)
@@ -2316,32 +3008,32 @@ def common_precalc():
         current_sample_db_time_samples=1
         return
 
-    current_sample_db_time_samples=int(in_samplerate_float*current_sample_db_time)
-
-    in_samplerate_by_fft_size = in_samplerate_float / FFT_SIZE
-    fft_duration= 1.0/in_samplerate_by_fft_size
-    l_info(f'{fft_duration=}')
+    in_queue_limit_samples=max(1,int(in_samplerate_float*float(cfg['in_queue_limit'])))
 
-    dummy_data=[200]*FFT_POINTS
-    fft_values_x_all=[0]*FFT_POINTS
-    fft_line_data_y=[-110]*FFT_POINTS
+    #everything below at the analysis samplerate (input samplerate after decimation)
+    in_decimation_resize(in_samplerate_float)
+    analysis_samplerate=in_samplerate_float/in_decimation
 
-    for i_fft in range(FFT_POINTS):
-        fft_values_x_all[i_fft]=i_fft * in_samplerate_by_fft_size
+    current_sample_db_time_samples=max(1,int(analysis_samplerate*current_sample_db_time))
 
-    fft_values_x_all=np_array(fft_values_x_all)
+    in_samplerate_by_fft_size = analysis_samplerate / FFT_SIZE
+    fft_duration= 1.0/in_samplerate_by_fft_size
+    l_info(f'{fft_duration=}')
 
-    bucket_fft_freqs=[0]*FFT_FBA_SIZE
-    bucket_fft_edges=[0]*(FFT_FBA_SIZE+1)
+    fft_hop_calc(analysis_samplerate)
 
-    for b in range(FFT_FBA_SIZE):
-        bucket_fft_freqs[b]= 10**(logf_min_audio + log_bucket_fft_width_by2 + log_bucket_fft_width * b)
-        bucket_fft_edges[b+1]= 10**(logf_min_audio + log_bucket_fft_width * (b+1))
+    plan=spectrum_plan_get(FFT_SIZE,cfg['fft_window'],analysis_samplerate,FFT_FBA_SIZE,FFT_DTYPE,FFT_CHANNELS_MAX,logf_min_audio,logf_max_audio,1 if FFT_SLIDING or FFT_MULTIRES>1 else FFT_WELCH,1 if FFT_SLIDING else FFT_MULTIRES,FFT_ZOOM,FFT_SLIDING)
+    l_info(f'spectrum plans cached:{len(spectrum_plans)}')
 
-    fft_bin_indices = digitize(fft_values_x_all, bucket_fft_edges)
-    l_info(f'fft_bin_indices={len(fft_bin_indices)}')
-    fft_bin_counts = bincount(fft_bin_indices)
-    l_info(f'fft_bin_counts={len(fft_bin_counts)}')
+    fft_window=plan['fft_window']
+    fft_values_x_all=plan['fft_values_x_all']
+    bucket_fft_freqs=plan['bucket_fft_freqs']
+    bucket_fft_edges=plan['bucket_fft_edges']
+    fft_bin_indices=plan['fft_bin_indices']
+    fft_bin_counts=plan['fft_bin_counts']
+    fft_bin_indices_selected=plan['fft_bin_indices_selected']
+    fft_values_x_bins=plan['fft_values_x_bins']
+    FFT_ACTUAL_BUCKETS=len(fft_bin_indices_selected)
 
     if DEBUG:
         try:
@@ -2356,13 +3048,15 @@ def common_precalc():
         except:
             pass
 
-    fft_bin_indices_selected=np_array([i for i,i_n in enumerate(isnan(bincount(fft_bin_indices, weights=dummy_data)[1:] / fft_bin_counts[1:])) if not i_n])
-    FFT_ACTUAL_BUCKETS=len(fft_bin_indices_selected)
-    fft_values_x_bins=np_array([bucket_fft_freqs[i] for i in fft_bin_indices_selected[:-1]])
+    level_samples=current_sample_db_time_samples
+    level_renorm_period=max(level_samples,int(analysis_samplerate))
+    lockin_two_pi_by_samplerate=two_pi/analysis_samplerate
 
-    fft_values_y_prev=None
+    data_ring_resize(max(plan['ring_size'],current_sample_db_time_samples))
+    mr_resize(plan)
+    sliding_reset(plan)
 
-    data=np_concatenate([zeros(FFT_SIZE),data])[-FFT_SIZE:]
+    spectrum_pre_calc(plan)
 
     precalc_ready=True
     next_check = 0
@@ -2796,8 +3490,13 @@ def theme_callback(ti):
     bind_item_theme("fft_line_shade",themes[TI]['fft_line_fill'])
     bind_item_theme("fft_line2",themes[TI]['fft_line2'])
     bind_item_theme("fft_line",themes[TI]['fft_line_with_fill' if FFT_FILL else 'fft_line'])
+    for ch in range(1,FFT_CHANNELS_MAX):
+        bind_item_theme(f"fft_line_ch{ch}",themes[TI][f'fft_line_ch{ch}'])
 
     bind_item_theme('fft_avg',themes[TI]['fft_avg_line_theme'])
+    bind_item_theme('fft_line_zoom',themes[TI]['fft_line_zoom'])
+    bind_item_theme('fft_hold_max',themes[TI]['fft_hold_max'])
+    bind_item_theme('fft_hold_min',themes[TI]['fft_hold_min'])
 
     for track in range(tracks):
         bind_item_theme(f"track{track}_bg",themes[TI]['track_bg'])
@@ -2906,6 +3605,353 @@ def peaks_limit_change():
     cfg['peaks_limit']=PEAKS_LIMIT=get_value('peaks_limit')
     cons_opt(f'Peaks number limit:{PEAKS_LIMIT}')
 
+ANALYSIS_INTERVAL=float(cfg['analysis_interval'])*0.001
+def analysis_interval_callback():
+    global ANALYSIS_INTERVAL
+    val=cfg['analysis_interval']=get_value('analysis_interval')
+    ANALYSIS_INTERVAL=float(val)*0.001
+    cons_opt(f'Minimum analysis interval:{val}ms')
+
+###########################################################
+# spectrum engine
+# thread  - spectrum_calc in the spectrum thread, newest samples copied
+# process - spectrum_calc in a worker process (sas.py --spectrum-worker),
+#           newest samples and resulting spectra are passed through shared memory
+# worker, connection and shared memory are owned by the processing thread only
+
+spectrum_pre={}
+spectrum_pre_id=0
+spectrum_state={}
+spectrum_skips=0
+
+def spectrum_pre_calc(plan):
+    global spectrum_pre,spectrum_pre_id
+
+    spectrum_pre=plan
+    spectrum_pre_id+=1
+    spectrum_state.clear()
+
+def spectrum_opt():
+    return {'each':IN_CHANNELS_EACH,'fba':FFT_FBA,'smooth':FFT_SMOOTH,'smooth_window':FFT_SMOOTH_WINDOW,'tda':FFT_TDA,'tda_factor':FFT_TDA_FACTOR,
+        'hold_max':FFT_HOLD_MAX,'hold_min':FFT_HOLD_MIN,'hold_decay':FFT_HOLD_DECAY,
+        'peaks':PEAKS,'peaks_avg_factor':PEAKS_AVG_FACTOR,'peaks_dist_factor':PEAKS_DIST_FACTOR,'peaks_limit':PEAKS_LIMIT,
+        'zoom_f':current_f if FFT_ZOOM and playing_state>0 else None,'zoom_only':FFT_ZOOM_ONLY and playing_state>0}
+
+IN_DECIMATE=cfg['in_decimate']=='auto'
+def in_decimate_callback(sender=None, app_data=None):
+    global IN_DECIMATE,precalc_ready,cfg
+
+    precalc_ready=False
+    val=cfg['in_decimate']=get_value('in_decimate')
+    l_info(f'in_decimate_callback:{sender},{app_data}')
+    cons_opt(f'Input decimation:{val}')
+
+    IN_DECIMATE=val=='auto'
+
+    common_precalc()
+
+###########################################################
+# peaks tracker - peaks of subsequent frames matched by frequency (within PEAKS_TRACK_TOL relative), stable slots
+# every track ages by 1 per frame and gets +2 (up to PEAKS_AGE_MAX) when matched, the value is averaged,
+# shown from PEAKS_AGE_SHOW (hysteresis) until the age runs out, on a fixed pool of plot annotations (no items churn)
+
+PEAKS_POOL=48
+PEAKS_AGE_MAX=15
+PEAKS_AGE_SHOW=3
+PEAKS_TRACK_TOL=0.01
+
+peaks_tracks={}     # slot -> [f,v,age,shown,label]
+
+def peaks_track(peaks):
+    for track in peaks_tracks.values():
+        track[2]-=1
+
+    matched=set()
+    for f,v in peaks:
+        best=None
+        best_dist=PEAKS_TRACK_TOL*f
+        for slot,track in peaks_tracks.items():
+            dist=abs(track[0]-f)
+            if dist<=best_dist and slot not in matched:
+                best,best_dist=slot,dist
+
+        if best is None:
+            free=[slot for slot in range(PEAKS_POOL) if slot not in peaks_tracks]
+            if not free:
+                continue
+            best=free[0]
+            peaks_tracks[best]=[f,v,0,False,'']
+
+        matched.add(best)
+        track=peaks_tracks[best]
+        track[0]=f
+        track[1]=(v+track[1]*(PEAKS_AGE_MAX-1))/PEAKS_AGE_MAX
+        track[2]=min(PEAKS_AGE_MAX,track[2]+2)
+
+    for slot,(f,v,age,shown,label) in list(peaks_tracks.items()):
+        tag=f'peak{slot}'
+        if age<=0:
+            if shown:
+                configure_item(tag,show=False)
+            del peaks_tracks[slot]
+        elif shown or age>=PEAKS_AGE_SHOW:
+            set_value(tag,(f,v))
+
+            #sub-bin frequency - one decimal place below 1kHz
+            new_label=f'{f:.1f}Hz' if f<1000.0 else f'{round(f)}Hz'
+            if new_label!=label or not shown:
+                configure_item(tag,label=new_label,show=True)
+                peaks_tracks[slot][3:]=[True,new_label]
+
+SPECTRUM_ENGINE_PROCESS=cfg['spectrum_engine']=='process'
+def spectrum_engine_callback(sender=None, app_data=None):
+    global SPECTRUM_ENGINE_PROCESS,cfg
+
+    val=cfg['spectrum_engine']=get_value('spectrum_engine')
+    l_info(f'spectrum_engine_callback:{sender},{app_data}')
+    cons_opt(f'Spectrum engine:{val}')
+
+    SPECTRUM_ENGINE_PROCESS=val=='process'
+
+SPECTRUM_WORKER_START_TIMEOUT=10.0 #[s]
+
+spectrum_worker_proc=None
+spectrum_worker_conn=None
+spectrum_worker_listener=None
+spectrum_worker_start_time=0
+spectrum_worker_busy=False
+spectrum_worker_pre_key=None
+spectrum_worker_pre=None
+spectrum_worker_calc_pre_id=0
+spectrum_shm_in=None
+spectrum_shm_out=None
+
+def spectrum_worker_start():
+    global spectrum_worker_proc,spectrum_worker_listener,spectrum_worker_start_time
+    from multiprocessing.connection import Listener
+
+    authkey=os.urandom(16)
+    listener=Listener(authkey=authkey)
+
+    if getattr(sys,'frozen',False):
+        command=[sys.executable]
+    else:
+        command=[sys.executable,abspath(__file__)]
+    command+=['--spectrum-worker',str(listener.address)]
+
+    l_info(f'spectrum_worker_start:{command}')
+
+    try:
+        proc=spectrum_worker_proc=Popen(command,stdin=PIPE,creationflags=0x08000000 if windows else 0)
+        proc.stdin.write(authkey.hex().encode()+b'\n')
+        proc.stdin.close()
+    except Exception as e:
+        cons_err(f'Spectrum worker start error:{e}')
+        listener.close()
+        spectrum_worker_engine_fallback()
+        return
+
+    spectrum_worker_listener=(listener,authkey)
+    spectrum_worker_start_time=perf_counter()
+
+    #connection appears when worker is ready, till then the processing thread calculates spectrum itself
+    def accept():
+        global spectrum_worker_conn,spectrum_worker_listener
+        try:
+            conn=listener.accept()
+            if proc is spectrum_worker_proc:
+                spectrum_worker_conn=conn
+                spectrum_worker_listener=None
+                cons_info('Spectrum worker ready')
+            else:
+                #start abandoned (spectrum_worker_check) - woken up by its own connection
+                conn.close()
+        except Exception as e:
+            cons_err(f'Spectrum worker connection error:{e}')
+        listener.close()
+
+    Thread(target=accept,daemon=True).start()
+
+def spectrum_worker_check():
+    #worker started, not connected yet - exited or no connection within the timeout: reported, thread engine used
+    proc=spectrum_worker_proc
+    exit_code=proc.poll()
+    if exit_code is None and perf_counter()<spectrum_worker_start_time+SPECTRUM_WORKER_START_TIMEOUT:
+        return
+
+    cons_err(f'Spectrum worker not connected (exit code:{exit_code}), spectrum engine:thread')
+
+    spectrum_worker_close()
+    spectrum_worker_engine_fallback()
+
+def spectrum_worker_engine_fallback():
+    global SPECTRUM_ENGINE_PROCESS
+
+    SPECTRUM_ENGINE_PROCESS=False
+    cfg['spectrum_engine']='thread'
+    set_value('spectrum_engine','thread')
+
+def spectrum_worker_close():
+    global spectrum_worker_proc,spectrum_worker_conn,spectrum_worker_busy,spectrum_worker_pre_key,spectrum_worker_pre,spectrum_shm_in,spectrum_shm_out,spectrum_worker_listener
+
+    l_info('spectrum_worker_close')
+
+    conn=spectrum_worker_conn
+    spectrum_worker_conn=None
+    spectrum_worker_busy=False
+    spectrum_worker_pre_key=None
+    spectrum_worker_pre=None
+
+    if conn is not None:
+        try:
+            conn.send(('exit',))
+            conn.close()
+        except Exception as e:
+            l_error(f'spectrum_worker_close:{e}')
+
+    if spectrum_worker_proc is not None:
+        try:
+            spectrum_worker_proc.wait(2)
+        except Exception:
+            spectrum_worker_proc.kill()
+        spectrum_worker_proc=None
+
+    if spectrum_worker_listener is not None:
+        #never connected - accept() in the waiting thread returns with this connection
+        listener,authkey=spectrum_worker_listener
+        spectrum_worker_listener=None
+        try:
+            from multiprocessing.connection import Client
+            Client(listener.address,authkey=authkey).close()
+        except Exception as e:
+            l_error(f'spectrum_worker_close:{e}')
+
+    for shm in (spectrum_shm_in,spectrum_shm_out):
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    spectrum_shm_in=spectrum_shm_out=None
+
+def spectrum_shm_get(shm,size):
+    from multiprocessing.shared_memory import SharedMemory
+
+    if shm is not None:
+        if shm.size>=size:
+            return shm
+        shm.close()
+        shm.unlink()
+
+    return SharedMemory(create=True,size=size)
+
+def spectrum_worker_send():
+    global spectrum_worker_busy,spectrum_skips,spectrum_worker_pre_key,spectrum_worker_pre,spectrum_worker_calc_pre_id,spectrum_shm_in,spectrum_shm_out
+
+    if spectrum_worker_busy:
+        spectrum_skips+=1
+        return
+
+    pre=spectrum_pre
+    tail_size=pre['tail_size']
+    tails=spectrum_tail(pre)
+    channels=len(tails[0])
+
+    pre_key=(spectrum_pre_id,channels)
+    if pre_key!=spectrum_worker_pre_key:
+        spectrum_shm_in=spectrum_shm_get(spectrum_shm_in,max(channels,FFT_CHANNELS_MAX)*tail_size*np_dtype(pre['dtype']).itemsize)
+        spectrum_shm_out=spectrum_shm_get(spectrum_shm_out,(FFT_CHANNELS_MAX+3)*pre['fft_points']*8)
+
+        spectrum_worker_conn.send(('pre',pre['key'],spectrum_shm_in.name,spectrum_shm_out.name))
+        spectrum_worker_pre_key=pre_key
+        spectrum_worker_pre=pre
+
+    np_concatenate(tails,axis=1,out=ndarray((channels,tail_size),dtype=pre['dtype'],buffer=spectrum_shm_in.buf))
+
+    spectrum_worker_conn.send(('calc',channels,spectrum_opt()))
+    spectrum_worker_calc_pre_id=spectrum_pre_id
+    spectrum_worker_busy=True
+
+def spectrum_worker_recv():
+    global spectrum_worker_busy
+
+    if not spectrum_worker_conn.poll():
+        return None
+
+    cmd,rows,points,fba,peaks,avg,holds,times,zoom=spectrum_worker_conn.recv()
+    spectrum_worker_busy=False
+
+    if spectrum_worker_calc_pre_id!=spectrum_pre_id:
+        #precalc changed in the meantime
+        return None
+
+    pre=spectrum_worker_pre
+    out=ndarray((FFT_CHANNELS_MAX+3,pre['fft_points']),dtype=float64,buffer=spectrum_shm_out.buf)
+
+    fft_values_y=out[:rows,:points].copy()
+    fft_values_y_avg=out[rows,:points].copy() if avg else None
+    holds=tuple(out[i,:points].copy() if hold else None for i,hold in enumerate(holds,rows+1))
+
+    if pre['sliding']:
+        fft_values_x=pre['sliding_x']
+    else:
+        fft_values_x=pre['fft_values_x_bins'] if fba else pre['fft_values_x_all']
+
+    return fft_values_x,fft_values_y,peaks,fft_values_y_avg,times,zoom,holds
+
+spectrum_thread_in=None
+spectrum_thread_out=None
+spectrum_thread_busy=False
+spectrum_thread_event=Event()
+
+def spectrum_thread_loop():
+    global spectrum_thread_in,spectrum_thread_out
+
+    while not exiting:
+        if not spectrum_thread_event.wait(0.25):
+            continue
+        spectrum_thread_event.clear()
+
+        job=spectrum_thread_in
+        spectrum_thread_in=None
+        if job is None:
+            continue
+
+        tail,pre,opt,pre_id=job
+        res=None
+        try:
+            res=spectrum_calc(tail,pre,opt,spectrum_state)
+        except Exception as exception_fft:
+            cons_err(f'{exception_fft=}')
+
+        spectrum_thread_out=(pre_id,res)
+        in_event_set()
+
+    l_info('spectrum thread - exiting.')
+
+def spectrum_thread_send():
+    global spectrum_thread_in,spectrum_thread_busy,spectrum_skips
+
+    if spectrum_thread_busy:
+        spectrum_skips+=1
+        return
+
+    spectrum_thread_in=(np_concatenate(spectrum_tail(spectrum_pre),axis=1),spectrum_pre,spectrum_opt(),spectrum_pre_id)
+    spectrum_thread_busy=True
+    spectrum_thread_event.set()
+
+def spectrum_thread_recv():
+    global spectrum_thread_out,spectrum_thread_busy
+
+    out=spectrum_thread_out
+    if out is None:
+        return None
+
+    spectrum_thread_out=None
+    spectrum_thread_busy=False
+
+    pre_id,res=out
+    return res if pre_id==spectrum_pre_id else None
+
 DEBUG=cfg['debug']
 def debug_callback():
     set_value('debug_text','')
@@ -2931,12 +3977,21 @@ def decorated_callback():
     cfg['decorated']=get_value('decorated')
 
 def fft_fill_callback():
-    global FFT_FILL
+    global FFT_FILL,fft_lines_ch_shown,fft_zoom_shown
     FFT_FILL=cfg['fft_fill']=get_value('fft_fill')
 
     configure_item('fft_line_shade',show=FFT_FILL and FFT)
     configure_item('fft_line2',show=not FFT_FILL and FFT)
     configure_item('fft_line',show=FFT)
+    configure_item('fft_line_zoom',show=False)
+    configure_item('fft_hold_max',show=False)
+    configure_item('fft_hold_min',show=False)
+
+    for ch in range(1,FFT_CHANNELS_MAX):
+        configure_item(f"fft_line_ch{ch}",show=False)
+    fft_lines_ch_shown=1
+    fft_zoom_shown=False
+    fft_holds_shown[:]=[False,False]
 
     theme_callback(TI)
 
@@ -3054,6 +4109,7 @@ sys.version
 portaudio_release,portaudio_descr=get_portaudio_version()
 distro_info+= "\nPython:" + sys.version + \
     "\nnumpy       " + str(numpy_version) + \
+    "\nFFT backend " + fft_backend_name + \
     "\nsounddevice " + str(sounddevice_version) + \
     "\nportaudio release " + str(portaudio_release) + \
     "\n" + portaudio_descr + "\n\nDearPyGui   " + str(dpg.get_dearpygui_version()) + "\n\n"
@@ -3163,18 +4219,21 @@ fft_proc_sum_time=0.0
 fft_peaks_sum_time=0.0
 
 in_errors=0
+in_overruns=0
+in_dropped=0
 
 processing_inside=1.0
 processing_outside=1.0
 
 def processing():
-    peaks_annos={}
-    peaks_count_max=15
-    peaks_count_max_m1=14
+    global sweeping,processing_inside,processing_outside
+    global redraw_recorded_track_line,frames,track_line_data_y_recorded,sweeping_i,logf_sweep_step,dragging,resizing,current_sample_db
+    global exiting,PEAKS,changes,fft_calcs,fft_calc_sum_time,in_samples,in_callbacks,current_sample_db_time_samples,precalc_ready,fft_proc_sum_time,fft_peaks_sum_time,in_errors
+    global in_fifo_r,in_overruns,in_dropped,fft_hop_left,fft_lines_ch_shown,fft_zoom_shown
 
-    global sweeping,processing_inside,processing_outside,fft_values_y_prev,FFT_TDA_FACTOR,FFT_TDA_FACTOR_1m,FFT_SMOOTH_WINDOW
-    global redraw_recorded_track_line,frames,track_line_data_y_recorded,sweeping_i,logf_sweep_step,dragging,resizing,samples_chunks_fifo,current_sample_db
-    global exiting,PEAKS,changes,fft_calcs,fft_calc_sum_time,in_samples,in_callbacks,current_sample_db_time_samples,data,precalc_ready,fft_proc_sum_time,fft_peaks_sum_time,in_errors,np_fft_rfft
+    in_fifo_blocks_seen=in_fifo_blocks
+    in_fifo_status_seen=in_fifo_status
+    in_fifo_overruns_seen=in_fifo_overruns
 
     next_sweep_time=0
     in_callbacks=-1
@@ -3187,6 +4246,12 @@ def processing():
 
     do_sleep=False
     next_mic_check=0
+    next_analysis_time=0
+    next_spectrum_time=0
+    fft_due=False
+    stage_done=False
+    annos_age=False
+    spectrum_res=None
 
     smooth_window=ones(3)/3.0
 
@@ -3195,168 +4260,247 @@ def processing():
         processing_outside+=processing_begin-processing_end
 
         if precalc_ready:
-            while stream_in is not None and samples_chunks_fifo:
+            if in_fifo_status!=in_fifo_status_seen:
+                in_errors+=in_fifo_status-in_fifo_status_seen
+                in_fifo_status_seen=in_fifo_status
+                cons_err(f'Input callback Error:{in_fifo_last_status}')
+
+            if in_fifo_overruns!=in_fifo_overruns_seen:
+                in_overruns+=in_fifo_overruns-in_fifo_overruns_seen
+                in_fifo_overruns_seen=in_fifo_overruns
+                cons_err(f'Input buffer overrun:{in_fifo_overruns}')
+
+            if stream_in is not None and in_fifo_w!=in_fifo_r:
                 data_new_chunk_len=0
-                data_len=0
                 try:
-                    data_len=len(data)
-
-                    data_new_chunk,status = samples_chunks_fifo_get()
+                    data_new_chunk_len=in_fifo_w-in_fifo_r
+
+                    #bounded latency - backlog over the limit is dropped according to the policy
+                    if data_new_chunk_len>in_queue_limit_samples:
+                        if IN_QUEUE_COALESCE:
+                            #only the newest window is analysed, once
+                            keep=min(data_new_chunk_len,data_ring_size*in_decimation)
+                            fft_hop_left=keep
+                        else:
+                            keep=in_queue_limit_samples
+
+                        skip=data_new_chunk_len-keep
+                        in_fifo_r+=skip
+                        in_dropped+=skip
+                        data_new_chunk_len=keep
+
+                    if FFT:
+                        if data_new_chunk_len>=fft_hop_left:
+                            fft_due=True
+                            if processing_begin>=next_spectrum_time:
+                                #stop exactly on the hop boundary, the rest is consumed after the FFT
+                                data_new_chunk_len=fft_hop_left
+                                fft_hop_left=FFT_HOP_IN
+                            else:
+                                #spectrum rate limited - everything consumed, the newest window is analysed when due
+                                fft_hop_left=FFT_HOP_IN-(data_new_chunk_len-fft_hop_left)%FFT_HOP_IN
+                        else:
+                            fft_hop_left-=data_new_chunk_len
 
-                    if status:
-                        cons_err(f'Input callback Error:{status}')
-                        in_errors+=1
+                    w=in_fifo_r+data_new_chunk_len
 
-                    data_new_chunk_len=len(data_new_chunk)
-                    if data_new_chunk_len>data_len:
-                        data = data_new_chunk[-data_len:]
+                    i=in_fifo_r & in_fifo_mask
+                    end=i+data_new_chunk_len
+                    if end<=in_fifo_size:
+                        in_put(in_fifo[i:end])
                     else:
-                        data = np_roll(data,-data_new_chunk_len)
-                        data[-data_new_chunk_len:]=data_new_chunk
+                        in_put(in_fifo[i:])
+                        in_put(in_fifo[:end-in_fifo_size])
+
+                    in_fifo_r=w
+
+                    blocks=in_fifo_blocks
+                    in_callbacks+=blocks-in_fifo_blocks_seen
+                    in_fifo_blocks_seen=blocks
 
-                    in_callbacks+=1
                     in_samples+=data_new_chunk_len
                     new_data=True
-                except IndexError:
-                    break
                 except Exception as dnc_e:
                     cons_err(f'{dnc_e=}')
                     cons_err(f'{data_new_chunk_len=}')
-                    cons_err(f'{data_len=}')
+                    cons_err(f'{data_ring_size=}')
 
-                    break
-
-            if new_data and not PAUSE:
-                #dragging or resizing
+            #level stage - input level and tracks recording, on every new block (rate limited)
+            if new_data and processing_begin>=next_analysis_time and not PAUSE:
                 new_data=False
+                next_analysis_time=processing_begin+ANALYSIS_INTERVAL
+                stage_done=True
                 changes+=1
 
-                current_sample_db = float64(10.0) * np_log10( np_mean(np_square(data[-current_sample_db_time_samples:])) + 1e-12)
-
-                new_dict={}
-                for fint,(i,v) in peaks_annos.items():
-                    tag=f'p{fint}'
-
-                    im1=i-1
-                    if im1>0:
-                        new_dict[fint]=(im1,v)
+                current_sample_db = level_db()
 
-                        try:
-                            delete_item(tag)
-                            col=10
-                            add_plot_annotation(tag=tag,label=f'{fint}Hz',parent='plot',default_value=(fint,v),  offset=(10,-10), color=(0,0,0,0))
-                        except Exception as ae:
-                            print(ae)
-                    else :
-                        delete_item(tag)
+                if playing_state==2 and track_line_data_y_recorded:
+                    track_line_data_y_recorded[current_bucket]*=TRACKS_TDA_FACTOR
+                    track_line_data_y_recorded[current_bucket]+=(lockin_db() if TRACKS_LOCKIN else current_sample_db)*TRACKS_TDA_FACTOR_1m
+                    redraw_recorded_track_line=True
 
-                peaks_annos=new_dict
+                set_value('cursor_db_txt', (25000, current_sample_db))
+                configure_item('cursor_db_txt',label=f'{round(current_sample_db)}dB')
 
-                if FFT and precalc_ready:
-                    try:
-                        t1=perf_counter()
-                        fft_values_y=float64(20.0)*np_log10( np_abs( np_fft_rfft(data[-FFT_SIZE:]*fft_window)) / FFT_SIZE + 1e-12 )
-                        fft_calcs+=1
+                if current_sample_db<-110:
+                    if processing_begin>next_mic_check:
+                        cons_err(f'No signal / Mic not connected ({current_sample_db}dB)')
+                        next_mic_check=processing_begin+1
 
-                        t2=perf_counter()
-                        fft_calc_sum_time+=t2-t1
+                if redraw_recorded_track_line:
+                    track=int(cfg['recorded'])
+                    if track!=-1:
+                        if cfg['show_track'][track]:
+                            set_value(f"track{track}_bg", [bucket_tracks_freqs, track_line_data_y[track]])
+                            set_value(f"track{track}", [bucket_tracks_freqs, track_line_data_y[track]])
 
-                        if PEAKS:
-                            fft_values_y_org=fft_values_y
+                    redraw_recorded_track_line=False
 
-                        if FFT_FBA:
-                            fft_values_means_in_buckets = bincount(fft_bin_indices, weights=fft_values_y)[1:] / fft_bin_counts[1:]
+                if not FFT and peaks_tracks:
+                    annos_age=True
 
-                            fft_values_y=np_array([fft_values_means_in_buckets[i] for i in fft_bin_indices_selected[:-1]])
-                            fft_values_x = fft_values_x_bins
+            #spectrum stage - on hop boundaries (rate limited), calculated outside of this thread
+            if fft_due and processing_begin>=next_spectrum_time and not PAUSE:
+                fft_due=False
+                next_spectrum_time=processing_begin+SPECTRUM_INTERVAL
+                stage_done=True
 
-                            if FFT_SMOOTH:
-                                fft_values_y = np_convolve(np_pad(fft_values_y,FFT_SMOOTH_FACTOR,'reflect'), FFT_SMOOTH_WINDOW, mode='valid')
+                if FFT and precalc_ready:
+                    try:
+                        if spectrum_worker_conn is not None:
+                            try:
+                                spectrum_worker_send()
+                            except OSError as exception_worker:
+                                #worker is gone, it is started again in the next loop
+                                cons_err(f'{exception_worker=}')
+                                spectrum_worker_close()
                         else:
-                            fft_values_x = fft_values_x_all
-
-                        if FFT_TDA:
-                            if fft_values_y_prev is not None:
-                                fft_values_y=FFT_TDA_FACTOR_1m*np_array(fft_values_y) + FFT_TDA_FACTOR*np_array(fft_values_y_prev)
-                            fft_values_y_prev=fft_values_y
-
-                        t3=perf_counter()
-                        fft_proc_sum_time+=t3-t2
-
-                        if PEAKS:
-                            points=len(fft_values_y)
+                            spectrum_thread_send()
+                    except Exception as exception_fft:
+                        cons_err(f'{exception_fft=}')
 
-                            dist_half=int(PEAKS_AVG_FACTOR*points/100.0)
-                            dist=dist_half*2
+            if spectrum_thread_busy:
+                spectrum_res=spectrum_thread_recv()
 
-                            cumsum = np_cumsum(np_pad(fft_values_y,dist_half,'reflect'))
-                            fft_values_y_avg = (cumsum[dist:] - cumsum[:-dist]) / dist
-                            if DEBUG:
-                                set_value("fft_avg", [fft_values_x, fft_values_y_avg])
+            if spectrum_worker_busy:
+                try:
+                    spectrum_res=spectrum_worker_recv()
+                except Exception as exception_worker:
+                    cons_err(f'{exception_worker=}')
+                    spectrum_worker_close()
+
+            #peaks tracks age with the FFT frames
+            if spectrum_res is not None or annos_age:
+                annos_age=False
+                try:
+                    peaks_track(spectrum_res[2] if spectrum_res is not None and PEAKS else ())
+                except Exception as exception_peaks:
+                    cons_err(f'{exception_peaks=}')
 
-                            diffs=fft_values_y-fft_values_y_avg
+            if spectrum_res is not None:
+                try:
+                    fft_values_x,fft_values_y_all,peaks,fft_values_y_avg,(t_calc,t_proc,t_peaks),zoom,holds=spectrum_res
+                    spectrum_res=None
 
-                            margin=int(1+(PEAKS_AVG_FACTOR/100.0)*PEAKS_DIST_FACTOR*points/100.0)
+                    stage_done=True
+                    changes+=1
 
-                            diffs_padded_windows = sliding_window_view( np_pad(diffs, margin, mode="constant", constant_values=-np_inf) , window_shape=2 * margin + 1)
+                    fft_calcs+=1
+                    fft_calc_sum_time+=t_calc
+                    fft_proc_sum_time+=t_proc
+                    fft_peaks_sum_time+=t_peaks
 
-                            maxs=diffs_padded_windows[:, margin] == diffs_padded_windows.max(axis=1)
+                    if (zoom is not None)!=fft_zoom_shown:
+                        fft_zoom_shown=zoom is not None
+                        configure_item('fft_line_zoom',show=fft_zoom_shown)
 
-                            peaks_annos_get = peaks_annos.get
+                    if zoom is not None:
+                        set_value("fft_line_zoom", [zoom[0], zoom[1]])
 
-                            for d,fint,v in nlargest(PEAKS_LIMIT,[(d,int(f),v) for m,d,f,v in zip(maxs,diffs,fft_values_x,fft_values_y) if m],key=lambda x: x[0]):
-                                curr_i,curr_v=peaks_annos_get(fint,(0,v))
-                                peaks_annos[fint]=(min(peaks_count_max,curr_i+2),(v+curr_v*peaks_count_max_m1)/peaks_count_max)
+                    #first row is the main trace (channels average or first channel)
+                    fft_values_y=fft_values_y_all[0]
+                    fft_rows=len(fft_values_y_all) if len(fft_values_y) else 0
 
-                            t4=perf_counter()
-                            fft_peaks_sum_time+=t4-t3
+                    if PEAKS and DEBUG and fft_values_y_avg is not None:
+                        set_value("fft_avg", [fft_values_x, fft_values_y_avg])
 
+                    if fft_rows:
                         if FFT_FILL:
                             set_value("fft_line_shade", [fft_values_x, fft_values_y,[dbmin]*len(fft_values_y)])
-                        else:
                             set_value("fft_line2", [fft_values_x, fft_values_y])
 
                         set_value("fft_line", [fft_values_x, fft_values_y])
 
-                    except Exception as exception_fft:
-                        cons_err(f'{exception_fft=}')
-
-                if playing_state==2 and track_line_data_y_recorded:
-                    track_line_data_y_recorded[current_bucket]*=TRACKS_TDA_FACTOR
-                    track_line_data_y_recorded[current_bucket]+=current_sample_db*TRACKS_TDA_FACTOR_1m
-                    redraw_recorded_track_line=True
-
-                set_value('cursor_db_txt', (25000, current_sample_db))
-                configure_item('cursor_db_txt',label=f'{round(current_sample_db)}dB')
-
-                if current_sample_db<-110:
-                    if processing_begin>next_mic_check:
-                        cons_err(f'No signal / Mic not connected ({current_sample_db}dB)')
-                        next_mic_check=processing_begin+1
-
-                if redraw_recorded_track_line:
-                    track=int(cfg['recorded'])
-                    if track!=-1:
-                        if cfg['show_track'][track]:
-                            set_value(f"track{track}_bg", [bucket_tracks_freqs, track_line_data_y[track]])
-                            set_value(f"track{track}", [bucket_tracks_freqs, track_line_data_y[track]])
-
-                    redraw_recorded_track_line=False
-            else:
+                    if fft_rows!=fft_lines_ch_shown:
+                        if not fft_rows or not fft_lines_ch_shown:
+                            #zoom only - broadband traces hidden while the frequency is generated
+                            configure_item('fft_line',show=fft_rows>0)
+                            configure_item('fft_line_shade',show=fft_rows>0 and FFT_FILL)
+                            configure_item('fft_line2',show=fft_rows>0 and not FFT_FILL)
+                        for ch in range(1,FFT_CHANNELS_MAX):
+                            configure_item(f"fft_line_ch{ch}",show=ch<fft_rows)
+                        fft_lines_ch_shown=fft_rows
+
+                    for ch in range(1,fft_rows):
+                        set_value(f"fft_line_ch{ch}", [fft_values_x, fft_values_y_all[ch]])
+
+                    for i,(hold,tag) in enumerate(zip(holds,('fft_hold_max','fft_hold_min'))):
+                        if (hold is not None)!=fft_holds_shown[i]:
+                            fft_holds_shown[i]=hold is not None
+                            configure_item(tag,show=fft_holds_shown[i])
+                        if hold is not None:
+                            set_value(tag, [fft_values_x, hold])
+
+                except Exception as exception_fft:
+                    cons_err(f'{exception_fft=}')
+
+            #no sleep while samples are waiting
+            if not stage_done and not (stream_in is not None and in_fifo_w!=in_fifo_r):
                 do_sleep=True
+            stage_done=False
         else:
             do_sleep=True
 
         processing_end=perf_counter()
         processing_inside+=processing_end-processing_begin
+
+        if SPECTRUM_ENGINE_PROCESS!=(spectrum_worker_proc is not None):
+            if SPECTRUM_ENGINE_PROCESS:
+                spectrum_worker_start()
+            else:
+                spectrum_worker_close()
+        elif spectrum_worker_listener is not None:
+            spectrum_worker_check()
+
         if do_sleep:
             do_sleep=False
-            sleep(0.0001)
+            if PAUSE:
+                in_event_wait(0.25)
+                in_event_clear()
+            elif new_data or fft_due:
+                #stages intervals - samples are collected meanwhile
+                wake_time=next_analysis_time if new_data else next_spectrum_time
+                if fft_due:
+                    wake_time=min(wake_time,next_spectrum_time)
+                if spectrum_worker_busy or spectrum_thread_busy:
+                    #spectrum result pending
+                    wake_time=min(wake_time,processing_end+0.002)
+                sleep(max(0.0,wake_time-processing_end))
+            else:
+                #new samples or spectrum thread result
+                in_event_wait(0.002 if spectrum_worker_busy else 0.25)
+                in_event_clear()
+
+    if spectrum_worker_proc is not None:
+        spectrum_worker_close()
 
     l_info('processing thread - exiting.')
     sys_exit()
 
-Thread(target=processing,daemon=True).start()
+processing_thread=Thread(target=processing,daemon=True)
+processing_thread.start()
+
+Thread(target=spectrum_thread_loop,daemon=True).start()
 
 def output_frame_buffer_callback(sender, app_data):
     try:
@@ -3385,9 +4529,9 @@ def output_frame_buffer_callback(sender, app_data):
 next_redraw=0
 def main_loop():
     global sweeping,out_callbacks,out_samples,set_viewport_pos_scheduled,set_viewport_resize_scheduled,schedule_screenshot
-    global frames,next_check,sweeping_i,logf_sweep_step,dragging,resizing,samples_chunks_fifo
+    global frames,next_check,sweeping_i,logf_sweep_step,dragging,resizing
     global CAPTURE,changes,settings_wrapper_scheduled,in_samples,in_callbacks,cfg,playing_state,lock_frequency,next_redraw
-    global console_shift,console_buffer,console_show_end_index,console_buffer_len,themes,fft_calc_sum_time,fft_calcs,console_color_tab,out_errors,in_errors,console_direction_mod,fft_proc_sum_time,fft_peaks_sum_time
+    global console_shift,console_buffer,console_show_end_index,console_buffer_len,themes,fft_calc_sum_time,fft_calcs,console_color_tab,out_errors,in_errors,in_overruns,in_dropped,console_direction_mod,fft_proc_sum_time,fft_peaks_sum_time,spectrum_skips
     global offset_x,offset_y,processing_inside,processing_outside
 
     next_sweep_time=0
@@ -3600,6 +4744,8 @@ def main_loop():
                                 f"samples/s  {out_samples:8d}    {in_samples:8d}",
                                 f"blocks/s   {out_callbacks:8d}    {in_callbacks:8d}",
                                 f"errors/s   {out_errors:8d}    {in_errors:8d}",
+                                f"overruns/s        -    {in_overruns:8d}",
+                                f"dropped/s         -    {in_dropped:8d}",
                                 " ",
                                 f"CPU        {stream_out_cpu_load:.6f}    {stream_in_cpu_load:.6f}",
                                 f"latency[s] {stream_out_latency:.6f}    {stream_in_latency:.6f}",
@@ -3616,7 +4762,11 @@ def main_loop():
                             fft_peaks_mean=fft_peaks_sum_time/fft_calcs if fft_calcs else 0
                             fft_peaks_in_sec=int(1.0/fft_peaks_mean) if fft_peaks_mean and PEAKS else 0
 
-                            part_fft = [f"FFT Window: {round(fft_duration,3)}s",
+                            part_fft = [f"FFT Window: {round(fft_duration,3)}s" + (f" x{FFT_WELCH} Welch" if FFT_WELCH>1 and FFT_MULTIRES==1 else "") + (f" .. {round(fft_duration*(1<<(FFT_MULTIRES-1)),3)}s multi-res" if FFT_MULTIRES>1 else "") + (" sliding" if FFT_SLIDING else "") + (f" / zoom {FFT_ZOOM}{' only' if FFT_ZOOM_ONLY else ''}" if FFT_ZOOM else ""),
+                                        f"FFT Hop: {FFT_HOP} / {fft_calcs:5d}/s",
+                                        f"Channels: {IN_CHANNELS} ({cfg['in_channels_mode']})" + (f" / decimation x{in_decimation} -> {round(analysis_samplerate)}Hz" if in_decimation>1 else ""),
+                                        f"Engine: {'process' if spectrum_worker_conn is not None else 'thread'} / {spectrum_skips:5d} skips/s",
+                                        f"FFT Backend: {fft_backend_name} / {fft_backend_time*1000:.3f}ms (2x64k)",
                                         f"FFT Calcs: {fft_calc_mean:.5f}s / {fft_calc_in_sec:5d}/s",
                                         f"FFT Procs: {fft_proc_mean:.5f}s / {fft_proc_in_sec:5d}/s",
                                         f"FFT Peaks: {fft_peaks_mean:.5f}s / {fft_peaks_in_sec:5d}/s",
@@ -3631,6 +4781,7 @@ def main_loop():
                             fft_calc_sum_time=0
                             fft_peaks_sum_time=0
                             fft_calcs=0
+                            spectrum_skips=0
 
                             l_info(f'DEB:\t{frames}/{changes}\t{main_ratio:.5f}/{proc_ratio:.5f}\t{fft_calc_mean:.5f}:{fft_proc_mean:.5f}:{fft_peaks_mean:.5f}\t{out_samples:}:{in_samples:}\t{out_callbacks:}:{in_callbacks:}\t{out_errors:}:{in_errors:}\t{stream_out_cpu_load:.6f}:{stream_in_cpu_load:.6f}\t{stream_out_latency:.6f}:{stream_in_latency:.6f}')
                         else:
@@ -3661,6 +4812,8 @@ def main_loop():
                 in_samples = 0
                 in_callbacks = 0
                 in_errors=0
+                in_overruns=0
+                in_dropped=0
 
                 main_loop_inside=0
                 main_loop_outside=0
@@ -3690,6 +4843,9 @@ cfg['viewport_width']=get_viewport_width()
 
 l_info('Exiting.')
 
+exiting=True
+processing_thread.join(3)
+
 sweeping=False
 lock_frequency=False
 
@@ -0,0 +1,748 @@
+#!/usr/bin/python3
+
+####################################################################################
+#
+#  Copyright (c) 2025-2026 Piotr Jochymek
+#
+#  MIT License
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+####################################################################################
+
+# FFT and post-processing pipeline (FBA, smoothing, TDA, peaks detection)
+# no GUI here - used directly by the processing thread of sas.py
+# or by the spectrum worker process (sas.py --spectrum-worker)
+
+from time import perf_counter
+
+from numpy import square as np_square,abs as np_abs,fft as np_fft,log10 as np_log10,mean as np_mean,bincount,pad as np_pad,cumsum as np_cumsum,inf as np_inf,ndarray,float64
+from numpy import arange,zeros,digitize,flatnonzero,searchsorted,add as np_add,ones,hanning,hamming,blackman,bartlett,kaiser,sinc,concatenate as np_concatenate
+from numpy import exp as np_exp,sum as np_sum,pi,float32,complex64,complex128,multiply as np_multiply,subtract as np_subtract,take as np_take,empty,rint,unique,maximum as np_maximum,argpartition,argsort
+from numpy import minimum as np_minimum,clip as np_clip,where as np_where,copyto as np_copyto,einsum as np_einsum,full
+from numpy.lib.stride_tricks import sliding_window_view
+from numpy.random import default_rng
+
+from collections import OrderedDict
+
+###########################################################
+# FFT backend - the fastest of the available rfft implementations, selected once at import
+# numpy  - always available, single threaded
+# scipy  - scipy.fft (pocketfft) with all cores as workers
+# pyfftw - FFTW with threads, plans kept in the pyfftw interfaces cache
+# backends are optional (not in requirements.txt), selected by a short benchmark
+
+FFT_BACKEND_BENCH_SIZE=1<<16
+
+def fft_backends():
+    #rfft(x,out) - out (preallocated complex result) is used by numpy only, the result is returned
+    #scipy.fft and pyfftw interfaces have no out parameter - they allocate the result on every call
+    backends={'numpy':lambda x,out=None: np_fft.rfft(x,out=out)}
+
+    try:
+        from scipy.fft import rfft as scipy_rfft
+        backends['scipy']=lambda x,out=None: scipy_rfft(x,workers=-1)
+    except Exception:
+        pass
+
+    try:
+        from os import cpu_count
+        import pyfftw
+        from pyfftw.interfaces.numpy_fft import rfft as pyfftw_rfft
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(60)
+        threads=cpu_count() or 1
+        backends['pyfftw']=lambda x,out=None: pyfftw_rfft(x,threads=threads)
+    except Exception:
+        pass
+
+    return backends
+
+def fft_backend_select():
+    #returns name,rfft,time of one (2,FFT_BACKEND_BENCH_SIZE) float64 transform [s]
+    bench=default_rng(0).standard_normal((2,FFT_BACKEND_BENCH_SIZE))
+
+    best=None
+    for name,rfft in fft_backends().items():
+        try:
+            rfft(bench)
+            t1=perf_counter()
+            for _ in range(3):
+                rfft(bench)
+            bench_time=(perf_counter()-t1)/3
+        except Exception:
+            continue
+
+        if best is None or bench_time<best[2]:
+            best=(name,rfft,bench_time)
+
+    return best
+
+fft_backend_name,fft_rfft,fft_backend_time=fft_backend_select()
+
+###########################################################
+# spectrum plans
+# all arrays needed for given fft size, window, sample rate and FBA size,
+# made once and kept in LRU cache limited by memory - switching back to used settings is instant
+# plans are shared (GUI, processing, spectrum thread) - arrays are read-only
+
+spectrum_windows={'ones':ones,'hanning':hanning,'hamming':hamming,'blackman':blackman,'bartlett':bartlett}
+
+SPECTRUM_PLANS_BYTES_MAX=256<<20
+spectrum_plans=OrderedDict()
+spectrum_plans_bytes=0
+
+#halfband lowpass for decimation by 2 - kaiser windowed sinc, passband to 0.4 / stopband from 0.6 of output nyquist (-95dB)
+#every second tap is zero, apart from the center one
+HALFBAND_TAPS=65
+HALFBAND_TOP=0.2 #usable top of decimated signal [input samplerate]
+
+#steeper halfband for the input decimation front end - passband to 0.225 of the input samplerate,
+#so 20kHz is kept down to 88.2kHz -> 44.1kHz; worst alias into 0-20kHz, measured through the whole cascade:
+#-109dB 88.2->44.1kHz, -115dB 96->48kHz, -105dB 192->48kHz, -107dB 384->48kHz (the earlier 65 taps stages limit these two)
+DECIMATE_TAPS=161
+DECIMATE_BETA=11.0
+DECIMATE_TOP=0.225
+
+def halfband_make(dtype,taps_count=HALFBAND_TAPS,beta=9.5):
+    #taps_count=4k+1
+    n=arange(taps_count)-(taps_count-1)//2
+    taps=sinc(0.5*n)*kaiser(taps_count,beta)
+    taps/=taps.sum()
+    return taps[1::2].astype(dtype),float(taps[(taps_count-1)//2])
+
+def halfband_decimate(hist,x,taps_odd,tap_center):
+    #hist - samples not consumed by previous call, x - new samples, both (channels,n)
+    #returns decimated samples (channels,m) and new hist
+    odd=len(taps_odd)
+    taps_count=2*odd+1
+
+    buf=np_concatenate((hist,x),axis=1)
+    count=(buf.shape[1]-taps_count)//2+1
+    if count<=0:
+        return buf[:,:0],buf
+
+    #polyphase - odd input samples through the odd taps, even ones through the center tap only
+    y=sliding_window_view(buf[:,1:2*(count+odd-1):2],odd,axis=-1) @ taps_odd
+    y+=tap_center*buf[:,taps_count//2:taps_count//2+2*count:2]
+
+    return y,buf[:,2*count:]
+
+#zoom - narrowband DFT bins around the stimulus frequency, half of the zoom window resolution apart
+ZOOM_BINS=41
+
+#sliding DFT - windows as sums of cosines a0-a1*cos(2pi*n/N)+a2*cos(4pi*n/N), applied in the frequency domain
+#on the neighbour bins (bartlett is not a sum of cosines - hanning is used)
+SLIDING_WINDOWS={'ones':(1.0,0.0,0.0),'hanning':(0.5,0.5,0.0),'hamming':(0.54,0.46,0.0),'blackman':(0.42,0.5,0.08),'bartlett':(0.5,0.5,0.0)}
+SLIDING_BLOCK=64     #block updates factorised as m=a*SLIDING_BLOCK+b, up to SLIDING_BLOCK*SLIDING_BLOCK samples at once
+
+def spectrum_plan_make(fft_size,window_name,samplerate,fba_size,dtype,channels_max,logf_min,logf_max,welch,multires,zoom,sliding):
+    fft_points=fft_size//2+1
+
+    #welch - number of averaged segments (50% overlap), 1 - single FFT
+    welch_step=fft_size//2
+    tail_size=fft_size+(welch-1)*welch_step
+
+    fft_window=spectrum_windows.get(window_name,ones)(fft_size).astype(dtype)
+
+    fft_values_x_all=arange(fft_points)*(samplerate/fft_size)
+
+    #multires - number of levels, every next one is decimated by 2 (in sas.py as samples come) and analysed with
+    #the same fft size (twice longer window), bins of all levels are stitched into one ascending spectrum,
+    #every level covers the octave(s) it resolves best
+    ring_size=tail_size
+    mr_taps_odd=mr_tap_center=mr_take=mr_level=None
+    if multires>1:
+        mr_taps_odd,mr_tap_center=halfband_make(dtype)
+        tail_size=multires*fft_size
+
+        mr_take=[]
+        mr_x=[]
+        mr_level=[]
+        for level in reversed(range(multires)):
+            x=fft_values_x_all/(1<<level)
+            mask=x<=samplerate*HALFBAND_TOP/(1<<(level-1)) if level else x>=0
+            if level<multires-1:
+                mask&=x>samplerate*HALFBAND_TOP/(1<<level)
+            bins=flatnonzero(mask)
+            mr_take.append(bins+level*fft_points)
+            mr_x.append(x[bins])
+            mr_level.append(full(len(bins),level))
+
+        mr_take=np_concatenate(mr_take)
+        mr_level=np_concatenate(mr_level)
+        fft_values_x_all=np_concatenate(mr_x)
+        fft_points=len(fft_values_x_all)
+
+    #zoom - the newest zoom samples (appended after the spectrum tail) windowed, mixed down by the stimulus
+    #frequency and transformed on ZOOM_BINS offsets only. DFT factorised as n=a*block+b:
+    #sum over b is one matrix product with zoom_e (block,bins), then weighted by zoom_f (blocks,bins) and summed over a
+    zoom_window=zoom_e=zoom_f=zoom_offsets=zoom_n_a=zoom_n_b=None
+    if zoom:
+        zoom_block=1<<(zoom.bit_length()//2)
+        zoom_blocks=zoom//zoom_block
+
+        zoom_window=spectrum_windows.get(window_name,ones)(zoom).astype(dtype).reshape(zoom_blocks,zoom_block)
+        zoom_offsets=(arange(ZOOM_BINS)-ZOOM_BINS//2)*(0.5*samplerate/zoom)
+        zoom_n_a=arange(zoom_blocks)*zoom_block
+        zoom_n_b=arange(zoom_block)
+
+        theta=(-2j*pi/samplerate)*zoom_offsets
+        complex_dtype=complex64 if dtype==float32 else complex128
+        zoom_e=np_exp(zoom_n_b[:,None]*theta).astype(complex_dtype)
+        zoom_f=np_exp(zoom_n_a[:,None]*theta).astype(complex_dtype)
+
+        ring_size=max(ring_size,zoom)
+        tail_size+=zoom
+
+    log_bucket_fft_width=(logf_max-logf_min)/fba_size
+    bucket_fft_freqs=10**(logf_min + log_bucket_fft_width*0.5 + log_bucket_fft_width*arange(fba_size))
+    bucket_fft_edges=zeros(fba_size+1)
+    bucket_fft_edges[1:]=10**(logf_min + log_bucket_fft_width*arange(1,fba_size+1))
+
+    fft_bin_indices=digitize(fft_values_x_all,bucket_fft_edges)
+
+    fft_bin_counts=bincount(fft_bin_indices,minlength=fba_size+2)
+
+    #not empty buckets
+    fft_bin_indices_selected=flatnonzero(fft_bin_counts[1:])
+    fba_buckets=fft_bin_indices_selected[:-1]
+    fft_values_x_bins=bucket_fft_freqs[fba_buckets]
+
+    #frequencies are sorted, so bins of every bucket are contiguous - FBA is one add.reduceat over fba_start:fba_end
+    #starting at fba_offsets (only the shown buckets), then scaled by 1/count
+    fba_starts=searchsorted(fft_bin_indices,fba_buckets+1)
+    fba_start=int(fba_starts[0])
+    fba_end=int(searchsorted(fft_bin_indices,fft_bin_indices_selected[-1]+1))
+    fba_offsets=fba_starts-fba_start
+    fba_inv_counts=1.0/fft_bin_counts[fba_buckets+1]
+    fba_ends=np_concatenate((fba_starts[1:],[fba_end]))
+
+    #sliding - DFT on the bins nearest to the shown buckets centres (and two neighbours on both sides for the window)
+    #updated with every input block in sas.py (exact, rectangular), the spectrum input is then the windowed power
+    #of these bins (channels,buckets) instead of the newest samples
+    sliding_x=sliding_bins=sliding_take=sliding_e=sliding_e_complex=sliding_f=sliding_coefs=None
+    if sliding:
+        centre=unique(rint(fft_values_x_bins*(fft_size/samplerate)).astype(int))
+        centre=centre[(centre>=2) & (centre<=fft_size//2-2)]
+        sliding_x=centre*(samplerate/fft_size)
+
+        sliding_bins,sliding_take=unique(centre+arange(-2,3)[:,None],return_inverse=True)
+        sliding_take=sliding_take.reshape(5,len(centre))
+
+        theta=(-2j*pi/fft_size)*sliding_bins
+        sliding_e_complex=np_exp(arange(SLIDING_BLOCK)[:,None]*theta)
+        sliding_e=np_concatenate((sliding_e_complex.real,sliding_e_complex.imag),axis=1)
+        sliding_f=np_exp((arange(SLIDING_BLOCK+1)*SLIDING_BLOCK)[:,None]*theta)
+        sliding_coefs=SLIDING_WINDOWS.get(window_name,SLIDING_WINDOWS['hanning'])
+
+        tail_size=len(centre)+zoom
+
+    plan={'fft_size':fft_size,'fft_points':fft_points,'welch':welch,'welch_step':welch_step,'tail_size':tail_size,
+        'ring_size':ring_size,'multires':multires,'mr_taps_odd':mr_taps_odd,'mr_tap_center':mr_tap_center,'mr_take':mr_take,'mr_level':mr_level,
+        'zoom_size':zoom,'zoom_window':zoom_window,'zoom_e':zoom_e,'zoom_f':zoom_f,'zoom_offsets':zoom_offsets,'zoom_n_a':zoom_n_a,'zoom_n_b':zoom_n_b,
+        'sliding':sliding,'sliding_x':sliding_x,'sliding_bins':sliding_bins,'sliding_take':sliding_take,'sliding_e':sliding_e,'sliding_e_complex':sliding_e_complex,'sliding_f':sliding_f,'sliding_coefs':sliding_coefs,'fft_window_name':window_name,'fft_window':fft_window,'dtype':dtype,'samplerate':samplerate,
+        'fba_size':fba_size,'channels_max':channels_max,'bucket_fft_freqs':bucket_fft_freqs,'bucket_fft_edges':bucket_fft_edges,
+        'fft_bin_indices':fft_bin_indices,'fft_bin_counts':fft_bin_counts,'fft_bin_indices_selected':fft_bin_indices_selected,
+        'fba_start':fba_start,'fba_end':fba_end,'fba_offsets':fba_offsets,'fba_inv_counts':fba_inv_counts,'fba_starts':fba_starts,'fba_ends':fba_ends,'fft_values_x_bins':fft_values_x_bins,'fft_values_x_all':fft_values_x_all}
+
+    nbytes=0
+    for v in plan.values():
+        if isinstance(v,ndarray):
+            v.flags.writeable=False
+            nbytes+=v.nbytes
+    plan['nbytes']=nbytes
+
+    return plan
+
+def spectrum_plan_get(fft_size,window_name,samplerate,fba_size,dtype,channels_max,logf_min,logf_max,welch=1,multires=1,zoom=0,sliding=False):
+    global spectrum_plans_bytes
+
+    key=(fft_size,window_name,samplerate,fba_size,dtype,channels_max,logf_min,logf_max,welch,multires,zoom,sliding)
+
+    plan=spectrum_plans.get(key)
+    if plan is not None:
+        spectrum_plans.move_to_end(key)
+        return plan
+
+    plan=spectrum_plans[key]=spectrum_plan_make(*key)
+    #spectrum_plan_get arguments - the worker process builds the same plan from its own cache
+    plan['key']=key
+    spectrum_plans_bytes+=plan['nbytes']
+
+    #the newest plan stays, even if alone exceeds the limit
+    while spectrum_plans_bytes>SPECTRUM_PLANS_BYTES_MAX and len(spectrum_plans)>1:
+        spectrum_plans_bytes-=spectrum_plans.popitem(last=False)[1]['nbytes']
+
+    return plan
+
+def running_max(a,width):
+    #maximum of every width long window of a (len(a)-width+1 values) in log2(width) vectorized steps
+    m=a
+    span=1
+    while span*2<=width:
+        m=np_maximum(m[:-span],m[span:])
+        span*=2
+
+    return np_maximum(m[:len(a)-width+1],m[width-span:])
+
+def peaks_refine(maxs,pre,opt,raw):
+    #sub-bin frequency and window scalloping correction of the peaks: parabola through the dB (log magnitude) values
+    #of the highest raw bin of every peak (of its FBA bucket) and its neighbours - exact for the gaussian, close for the cosine windows
+    #returns frequencies and levels (parabola apex - the raw peak level, not the FBA/smoothed/TDA trace value)
+    if opt['fba']:
+        starts=pre['fba_starts'][maxs]
+        ends=pre['fba_ends'][maxs]
+        idx=starts[:,None]+arange(int((ends-starts).max()))
+        vals=raw[np_minimum(idx,len(raw)-1)]
+        vals[idx>=ends[:,None]]=-np_inf
+        bins=starts+vals.argmax(axis=1)
+    else:
+        bins=maxs
+
+    bins=np_clip(bins,1,len(raw)-2)
+    a=raw[bins-1]
+    b=raw[bins]
+    c=raw[bins+1]
+
+    #not a maximum of the raw bins (edge, flat) - no shift
+    curv=a-2.0*b+c
+    refine=curv<0.0
+
+    #multires - neighbours from another level (different bin width) - no shift
+    mr_level=pre['mr_level']
+    if mr_level is not None:
+        refine&=(mr_level[bins-1]==mr_level[bins]) & (mr_level[bins+1]==mr_level[bins])
+
+    shift=np_clip(np_where(refine,0.5*(a-c)/np_where(refine,curv,-1.0),0.0),-0.5,0.5)
+
+    x=pre['fft_values_x_all']
+    return x[bins]+shift*0.5*(x[bins+1]-x[bins-1]),b-0.25*(a-c)*shift
+
+###########################################################
+# scratch buffers - preallocated per caller state (one spectrum thread or worker process), plan and input shape/dtype,
+# the steady state FFT -> dB -> FBA path allocates no arrays with the numpy backend and float64 (numpy ufunc buffers only),
+# exceptions: numpy float32 rfft allocates internally (~2MB per frame at 65536x2), scipy/pyfftw allocate the result
+# checked by scripts/spectrum.alloc.check.py
+# results returned in scratch buffers are valid until the next spectrum_calc call with the same state
+
+def spectrum_scratch(tail,pre,each,state):
+    key=(tail.shape,tail.dtype,each)
+    scratch=state.get('scratch')
+    #plan compared by identity - the state may outlive its plan (frame in flight while the plan changes)
+    if scratch is not None and scratch['pre'] is pre and scratch['key']==key:
+        return scratch
+
+    dtype=pre['dtype']
+    fft_size=pre['fft_size']
+    channels=len(tail)
+
+    if pre['multires']>1:
+        shape=(channels,pre['multires'],fft_size)
+        summed=1
+    elif pre['welch']>1:
+        shape=(channels,1+(tail.shape[1]-fft_size)//pre['welch_step'],fft_size)
+        summed=shape[1]
+    else:
+        shape=(channels,fft_size)
+        summed=1
+
+    if not each:
+        summed*=channels
+
+    points_shape=shape[:-1]+(fft_size//2+1,)
+    rows=channels if each else 1
+
+    norm=float(summed)*fft_size*fft_size
+    scratch=state['scratch']={
+        'pre':pre,
+        'key':key,
+        'windowed':empty(shape,dtype=dtype),
+        'spectrum':empty(points_shape,dtype=complex64 if dtype==float32 else complex128),
+        'power':empty(points_shape,dtype=dtype),
+        'power_imag':empty(points_shape,dtype=dtype),
+        'sum':empty(points_shape[1:],dtype=dtype),
+        'y':empty((rows,pre['fft_points']),dtype=dtype),
+        'db_floor':1e-24*norm,
+        'db_offset':10.0*float(np_log10(norm))
+        }
+    return scratch
+
+def spectrum_power(x,pre,scratch):
+    #|rfft(x*window)|^2 on scratch buffers, no square root
+    windowed=np_multiply(x,pre['fft_window'],out=scratch['windowed'])
+    spectrum=fft_rfft(windowed,out=scratch['spectrum'])
+
+    fft_power=np_square(spectrum.real,out=scratch['power'])
+    np_add(fft_power,np_square(spectrum.imag,out=scratch['power_imag']),out=fft_power)
+    return fft_power
+
+###########################################################
+# FBA and smoothing composed into one banded operator - bucket sums (reduceat, all traces in one call) written into
+# a reflect padded buffer, then one product with the (buckets,width) band of weights: smoothing window folded with
+# 1/count of the buckets (width 1 - FBA alone, counts 1 - sliding DFT buckets)
+# built per caller state, rebuilt when the plan, the smoothing window or the traces count changes
+
+def spectrum_bands(pre,opt,rows,dtype,state):
+    smooth=opt['smooth']
+    key=(rows,dtype,smooth and opt['smooth_window'].tobytes())
+    bands=state.get('bands')
+    #plan compared by identity - the state may outlive its plan (frame in flight while the plan changes)
+    if bands is not None and bands['pre'] is pre and bands['key']==key:
+        return bands
+
+    if pre['sliding']:
+        buckets=len(pre['sliding_x'])
+        inv_counts=ones(buckets)
+    else:
+        buckets=len(pre['fba_offsets'])
+        inv_counts=pre['fba_inv_counts']
+
+    window=ones(1)
+    if smooth:
+        #hanning ends are zeros
+        window=opt['smooth_window']
+        nonzero=flatnonzero(window)
+        window=window[nonzero[0]:nonzero[-1]+1]
+    width=len(window)
+    half=width//2
+
+    padded_index=np_pad(arange(buckets),half,'reflect')
+
+    padded=empty((rows,buckets+2*half),dtype=dtype)
+    bands=state['bands']={
+        'pre':pre,
+        'key':key,
+        'half':half,
+        'weights':(sliding_window_view(inv_counts[padded_index],width)*window).astype(dtype),
+        'padded':padded,
+        'inner':padded[:,half:half+buckets],
+        'left':padded[:,:half],
+        'left_index':padded_index[:half]+half,
+        'right':padded[:,half+buckets:],
+        'right_index':padded_index[half+buckets:]+half,
+        'windows':sliding_window_view(padded,width,axis=-1),
+        'y':empty((rows,buckets),dtype=dtype)
+        }
+    return bands
+
+def spectrum_bands_apply(fft_values_y,pre,opt,state):
+    bands=spectrum_bands(pre,opt,len(fft_values_y),fft_values_y.dtype,state)
+
+    inner=bands['inner']
+    if pre['sliding']:
+        np_copyto(inner,fft_values_y)
+    else:
+        np_add.reduceat(fft_values_y[:,pre['fba_start']:pre['fba_end']],pre['fba_offsets'],axis=-1,out=inner)
+
+    if not bands['half']:
+        #FBA alone - band of width 1
+        return np_multiply(inner,bands['weights'][:,0],out=bands['y'])
+
+    np_take(bands['padded'],bands['left_index'],axis=1,out=bands['left'],mode='clip')
+    np_take(bands['padded'],bands['right_index'],axis=1,out=bands['right'],mode='clip')
+
+    return np_einsum('rbw,bw->rb',bands['windows'],bands['weights'],out=bands['y'])
+
+###########################################################
+# averaging stage - TDA of all traces, peak-hold and min-hold of the main trace (with decay in dB/s)
+# updated in place on buffers kept in the caller state (cleared with the plan, reset with the traces shape)
+# returned buffers are valid until the next spectrum_calc call with the same state
+
+def spectrum_average(fft_values_y,opt,state):
+    key=(fft_values_y.shape,fft_values_y.dtype)
+    average=state.get('average')
+    if average is None or average['key']!=key:
+        rows,points=fft_values_y.shape
+        average=state['average']={
+            'key':key,
+            'tda':empty((rows,points),dtype=fft_values_y.dtype),
+            'diff':empty((rows,points),dtype=fft_values_y.dtype),
+            'max':empty(points,dtype=fft_values_y.dtype),
+            'min':empty(points,dtype=fft_values_y.dtype),
+            'ready':set(),
+            'time':0.0
+            }
+
+    ready=average['ready']
+
+    now=perf_counter()
+    decay=opt['hold_decay']*(now-average['time'])
+    average['time']=now
+
+    #holds of the current (not averaged) frame - short events are not flattened by TDA
+    holds=[]
+    for name,enabled,relax,extreme in (('max',opt['hold_max'],np_subtract,np_maximum),('min',opt['hold_min'],np_add,np_minimum)):
+        if not enabled:
+            ready.discard(name)
+            holds.append(None)
+            continue
+
+        hold=average[name]
+        if name in ready:
+            relax(hold,decay,out=hold)
+            extreme(hold,fft_values_y[0],out=hold)
+        else:
+            np_copyto(hold,fft_values_y[0])
+            ready.add(name)
+        holds.append(hold)
+
+    if opt['tda']:
+        tda=average['tda']
+        if 'tda' in ready:
+            #tda=(1-tda_factor)*y + tda_factor*tda
+            diff=np_subtract(fft_values_y,tda,out=average['diff'])
+            np_multiply(diff,1.0-opt['tda_factor'],out=diff)
+            np_add(tda,diff,out=tda)
+        else:
+            np_copyto(tda,fft_values_y)
+            ready.add('tda')
+        fft_values_y=tda
+    else:
+        ready.discard('tda')
+
+    return fft_values_y,tuple(holds)
+
+###########################################################
+def spectrum_zoom(tail,pre,f,each):
+    #narrowband spectrum around f (channels average or first channel), returns zoom_x,zoom_y
+    #mixing by f folded into the factors - the only large operation is one real matrix product
+    zoom_size=pre['zoom_size']
+    zoom_window=pre['zoom_window']
+
+    if each:
+        tail=tail[:1]
+
+    phase_step=-2j*pi*f/pre['samplerate']
+    zoom_e=pre['zoom_e']*np_exp(phase_step*pre['zoom_n_b'])[:,None]
+    zoom_f=pre['zoom_f']*np_exp(phase_step*pre['zoom_n_a'])[:,None]
+
+    partial=(tail.reshape(len(tail),*zoom_window.shape)*zoom_window) @ np_concatenate((zoom_e.real,zoom_e.imag),axis=1).astype(zoom_window.dtype)
+    zoom_dft=np_sum((partial[...,:ZOOM_BINS]+1j*partial[...,ZOOM_BINS:])*zoom_f,axis=1)
+
+    return pre['zoom_offsets']+f,10.0*np_log10( np_mean(np_square(np_abs(zoom_dft)),axis=0) / (zoom_size*zoom_size) + 1e-24 )
+
+def spectrum_calc(tail,pre,opt,state):
+    # tail  - (channels,tail_size) newest samples
+    # pre   - spectrum plan (spectrum_plan_get)
+    # opt   - post-processing options
+    # state - kept between calls (scratch buffers, TDA, holds)
+    # returns fft_values_x,fft_values_y (one row per trace),peaks [(f,v)],fft_values_y_avg,(t_calc,t_proc,t_peaks),zoom (zoom_x,zoom_y) or None,
+    #   holds (hold_max,hold_min) - main trace or None
+
+    t1=perf_counter()
+
+    fft_size=pre['fft_size']
+
+    each=opt['each'] or len(tail)==1
+    if each:
+        tail=tail[:pre['channels_max']]
+
+    zoom=None
+    zoom_size=pre['zoom_size']
+    if zoom_size:
+        zoom_tail=tail[:,-zoom_size:]
+        tail=tail[:,:-zoom_size]
+
+        if opt['zoom_f'] is not None:
+            zoom=spectrum_zoom(zoom_tail,pre,opt['zoom_f'],each)
+
+        if opt['zoom_only']:
+            t2=perf_counter()
+            return pre['fft_values_x_all'][:0],zeros((1,0)),[],None,(t2-t1,0.0,0.0),zoom,(None,None)
+
+    if pre['sliding']:
+        #sliding DFT - windowed power of the buckets centre bins (channels,buckets), calculated as samples come (sas.py)
+        if each:
+            fft_values_y=10.0*np_log10( tail / (fft_size*fft_size) + 1e-24 )
+        else:
+            fft_values_y=10.0*np_log10( np_mean(tail,axis=0,keepdims=True) / (fft_size*fft_size) + 1e-24 )
+    else:
+        scratch=spectrum_scratch(tail,pre,each,state)
+        fft_values_y=scratch['y']
+
+        if pre['multires']>1:
+            #multi-resolution - the newest fft_size samples of every level (tail_size=multires*fft_size), all levels of all channels in one batched rfft
+            fft_power=spectrum_power(tail.reshape(len(tail),pre['multires'],fft_size),pre,scratch)
+            if each:
+                np_take(fft_power.reshape(len(tail),-1),pre['mr_take'],axis=1,out=fft_values_y)
+            else:
+                np_take(np_sum(fft_power,axis=0,out=scratch['sum']).reshape(-1),pre['mr_take'],out=fft_values_y[0])
+        elif pre['welch']>1:
+            #welch - overlapping windowed segments of all channels in one batched rfft, power averaged over segments (and channels)
+            fft_power=spectrum_power(sliding_window_view(tail,fft_size,axis=-1)[:,::pre['welch_step']],pre,scratch)
+            if each:
+                np_sum(fft_power,axis=1,out=fft_values_y)
+            else:
+                np_sum(fft_power,axis=(0,1),out=fft_values_y[0])
+        else:
+            #all channels in one batched rfft
+            fft_power=spectrum_power(tail,pre,scratch)
+            if each:
+                fft_values_y=fft_power
+            else:
+                np_sum(fft_power,axis=0,out=fft_values_y[0])
+
+        #power domain dB, mean of the summed spectra and 1/fft_size^2 normalisation folded into the constants
+        np_add(fft_values_y,scratch['db_floor'],out=fft_values_y)
+        np_log10(fft_values_y,out=fft_values_y)
+        np_multiply(fft_values_y,10.0,out=fft_values_y)
+        np_subtract(fft_values_y,scratch['db_offset'],out=fft_values_y)
+
+    t2=perf_counter()
+
+    #main trace bins before FBA for the peaks refinement (scratch buffer, not modified below)
+    peaks_raw=None if pre['sliding'] else fft_values_y[0]
+
+    if pre['sliding']:
+        #already one value per bucket
+        fft_values_x=pre['sliding_x']
+        if opt['smooth']:
+            fft_values_y=spectrum_bands_apply(fft_values_y,pre,opt,state)
+    elif opt['fba']:
+        fft_values_x=pre['fft_values_x_bins']
+        fft_values_y=spectrum_bands_apply(fft_values_y,pre,opt,state)
+    else:
+        fft_values_x=pre['fft_values_x_all']
+
+    if opt['tda'] or opt['hold_max'] or opt['hold_min']:
+        fft_values_y,holds=spectrum_average(fft_values_y,opt,state)
+    else:
+        state.pop('average',None)
+        holds=(None,None)
+
+    t3=perf_counter()
+
+    peaks=[]
+    fft_values_y_avg=None
+
+    if opt['peaks']:
+        #first row is the main trace (channels average or first channel)
+        y=fft_values_y[0]
+        points=len(y)
+
+        peaks_avg_factor=opt['peaks_avg_factor']
+
+        dist_half=int(peaks_avg_factor*points/100.0)
+        dist=dist_half*2
+
+        cumsum = np_cumsum(np_pad(y,dist_half,'reflect'))
+        fft_values_y_avg = (cumsum[dist:] - cumsum[:-dist]) / dist
+
+        diffs=y-fft_values_y_avg
+
+        margin=int(1+(peaks_avg_factor/100.0)*opt['peaks_dist_factor']*points/100.0)
+
+        #local maxima of diffs within +-margin, then the peaks_limit highest of them (descending)
+        maxs=flatnonzero(diffs==running_max(np_pad(diffs, margin, mode="constant", constant_values=-np_inf),2*margin+1))
+
+        skip=len(maxs)-opt['peaks_limit']
+        if skip>0:
+            maxs=maxs[argpartition(diffs[maxs],skip)[skip:]]
+        maxs=maxs[argsort(diffs[maxs])[::-1]]
+
+        if peaks_raw is not None and len(maxs):
+            peaks_f,peaks_level=peaks_refine(maxs,pre,opt,peaks_raw)
+            peaks=list(zip(peaks_f.tolist(),peaks_level.tolist()))
+        else:
+            peaks=list(zip(fft_values_x[maxs].tolist(),y[maxs].tolist()))
+
+    t4=perf_counter()
+
+    return fft_values_x,fft_values_y,peaks,fft_values_y_avg,(t2-t1,t3-t2,t4-t3),zoom,holds
+
+###########################################################
+# spectrum worker process
+# samples come in and spectra go back through shared memory,
+# the connection carries only small control messages:
+#   ('pre',plan_key,shm_in_name,shm_out_name) - plan_key: spectrum_plan_get arguments (plan['key'])
+#   ('calc',channels,opt) -> ('res',rows,points,fba,peaks,avg,holds,times,zoom)
+# shm_out rows: traces, peaks reference average, hold max, hold min
+#   ('exit',)
+
+def shm_attach(name):
+    from multiprocessing.shared_memory import SharedMemory
+    try:
+        return SharedMemory(name=name,track=False)
+    except TypeError:
+        #python<3.13 - no track parameter, segment is unlinked by its owner (sas.py) only
+        from multiprocessing import resource_tracker
+        shm=SharedMemory(name=name)
+        resource_tracker.unregister(shm._name,'shared_memory')
+        return shm
+
+def spectrum_worker(address,authkey_hex):
+    from multiprocessing.connection import Client
+
+    conn=Client(address,authkey=bytes.fromhex(authkey_hex))
+
+    pre=None
+    shm_in=shm_out=None
+    state={}
+
+    while True:
+        try:
+            msg=conn.recv()
+        except EOFError:
+            break
+
+        cmd=msg[0]
+        if cmd=='calc':
+            channels,opt=msg[1],msg[2]
+
+            tail=ndarray((channels,pre['tail_size']),dtype=pre['dtype'],buffer=shm_in.buf)
+
+            fft_values_x,fft_values_y,peaks,fft_values_y_avg,times,zoom,holds=spectrum_calc(tail,pre,opt,state)
+            del tail
+
+            rows,points=fft_values_y.shape
+            out=ndarray((pre['channels_max']+3,pre['fft_points']),dtype=float64,buffer=shm_out.buf)
+            out[:rows,:points]=fft_values_y
+            avg=fft_values_y_avg is not None
+            if avg:
+                out[rows,:points]=fft_values_y_avg
+            for i,hold in enumerate(holds,rows+1):
+                if hold is not None:
+                    out[i,:points]=hold
+            del out
+
+            try:
+                conn.send(('res',rows,points,opt['fba'],peaks,avg,tuple(hold is not None for hold in holds),times,zoom))
+            except OSError:
+                break
+
+        elif cmd=='pre':
+            pre=spectrum_plan_get(*msg[1])
+            state={}
+
+            for shm in (shm_in,shm_out):
+                if shm is not None:
+                    shm.close()
+
+            shm_in=shm_attach(msg[2])
+            shm_out=shm_attach(msg[3])
+
+        elif cmd=='exit':
+            break
+
+    for shm in (shm_in,shm_out):
+        if shm is not None:
+            shm.close()
+
+    conn.close()